@@ -163,7 +163,7 @@ class ANSIban:
         # First part. Banner & keys.
         banner = "\033[1;36mSOCONBAN \033[0;36m0.1    " + \
             key("←↑↓→", "Move") + key("q", "Quit") + \
-            key("r", "Restart") + key("u", "Undo")
+            key("r", "Restart") + key("u", "Undo") + key("y", "Redo")
         self.headerheight = 1
         # add other headerlines / status
         for s in self.state:
@@ -245,7 +245,7 @@ class ANSIban:
         charwidth = len(self.RENDER[render][0][0])
         s = ""
         if border: s += border + "╔" + ("═" * w*charwidth) + "╗" + self.RESET + "\n"
-        for row in self.soko.currentgrid.grid:
+        for row in self.soko.currentgrid.rows():
             for i in range(len(self.RENDER[render][0])):
                 if border: s += border + "║" + self.RESET
                 s += "".join([self.RENDER[render][c][i] for c in row])
@@ -276,12 +276,11 @@ class ANSIban:
         Start playing currentlevel. return true if solved, false if quit.
         arrowkeys to move
         u to undo
+        y to redo
         r to restart
         q to quit
         """
-        self.currsol = None
-        cs = self.soko.getsolution()
-        if cs is not None: self.currsol = (len(cs)-1, cs[-1][1])
+        self.currsol = self.soko.getsummary()
         # clear screen
         sys.stdout.write(clear)
         self.drawfield()
@@ -290,7 +289,7 @@ class ANSIban:
             # check key
             key = getch()
             if key == "q": return False
-            if key in ("<","^", "v", ">", "r", "u"): 
+            if key in ("<","^", "v", ">", "r", "u", "y"): 
                 done = self.soko.play(key)
                 self.drawfield()
                 if done: return True
@@ -303,9 +302,9 @@ class ANSIban:
             # freudentanz
             sys.stdout.write("\a")
             for i in range(2, dance):
-                for row in self.soko.currentgrid.grid:
-                    for col in range(len(row)):
-                        if row[col] == i % 3 + 1: row[col] = (i + 1) % 3 + 1
+                cells = self.soko.currentgrid.cells
+                for c in range(len(cells)):
+                    if cells[c] == i % 3 + 1: cells[c] = (i + 1) % 3 + 1
                 self.drawfield()
                 time.sleep(.04)
             
@@ -313,13 +312,13 @@ class ANSIban:
             pname = self.soko.packinfo['title']
             lname = "[%d] %s" % (self.soko.levelinfo['idx'], self.soko.levelinfo['name'])
 
-            sol = self.soko.getsolution()
+            sol = self.soko.getsummary()
             solved = "Found a new Solution!"
             if sol is not None:
-                if (len(sol)-1) <= len(self.soko.undo):
-                    solved = "Best solution so far: %d moves, %d pushes" % (len(sol)-1, sol[-1][1])
+                if sol[0] <= len(self.soko.solutionmoves()):
+                    solved = "Best solution so far: %d moves, %d pushes" % sol
                 else:
-                    solved = "Found a better solution! (less than %d moves)" % (len(sol)-1)
+                    solved = "Found a better solution! (less than %d moves)" % sol[0]
             
             pwidth = max(len(x) for x in (pfile, pname, lname, self.soko.curtime, solved))
             pwidth = max(pwidth, 15) # <press a key>
@@ -406,9 +405,9 @@ class ANSIban:
                 self.header()
                 if not skip:
                     def movs(n):
-                        gs = self.soko.getsolution(n)
-                        return (len(gs)-1, gs[-1][1]) if gs is not None else None
-                    ltxt = [x[0] + (" - unsolved" if movs(n) is None else " - solved: %d,%d" % movs(n)) for n,x in enumerate(self.soko.levellist())]
+                        gs = self.soko.getsummary(n)
+                        return " - unsolved" if gs is None else " - solved: %d,%d" % gs
+                    ltxt = [x[0] + movs(n) for n,x in enumerate(self.soko.levellist())]
                     newlevel = self.listselect(ltxt, self.soko.levelinfo['idx'])
                     if newlevel is None: break
                     self.soko.loadlevel(newlevel)
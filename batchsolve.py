@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# batchsolve: lässt den Solver über ganze Levelpacks laufen, verteilt auf
+# mehrere Prozesse. Jedes fertige Level landet sofort als eine JSON-Zeile in
+# der Ergebnisdatei (und gefundene Lösungen im Lösungsspeicher). Wird der
+# Lauf abgebrochen, macht der nächste dort weiter, wo der letzte aufgehört hat.
+#
+# One record per level:
+#   {"pack": str, "level": int, "status": str, "moves": int, "pushes": int,
+#    "nodes": int, "time": float, "solution": str, "error": str}
+# status is one of 'solved', 'unsolvable', 'limit' (out of time or nodes,
+# error says so if the solver had to be stopped), 'memory' or 'error' (with
+# its message in error). moves, pushes and solution are only there if there
+# is a solution: with method anytime a level can be 'limit' and still have
+# one (which may get better on --retry, continuing from its checkpoint).
+
+import os, sys, json, time, signal, argparse, multiprocessing, converda, solver, sokoban
+try:
+    import resource
+except ImportError: # windows: no memory limit
+    resource = None
+
+GRACE = 10 # seconds a level may run over --maxtime before it is stopped (not on windows)
+
+class Timeout(Exception):
+    """the solver didn't stop at its deadline, see GRACE"""
+
+def timeout(signum, frame):
+    raise Timeout()
+
+def initworker(levelzip, maxmem):
+    converda.initworker(levelzip)
+    if maxmem and resource:
+        resource.setrlimit(resource.RLIMIT_AS, (maxmem << 20, resource.RLIM_INFINITY))
+    if hasattr(signal, "setitimer"): signal.signal(signal.SIGALRM, timeout)
+
+def solvelevel(task):
+    """solve one level in a worker process, returns its record"""
+    packfile, idx, method, options, stats = task
+    result = {'pack': packfile, 'level': idx}
+    start = time.time()
+    sol = moves = None
+    fo = open(stats, "a") if stats else None # all workers append to it, line by line
+    # the solver looks at the clock between nodes only, this stops it anyway
+    alarm = options.get('maxtime') is not None and hasattr(signal, "setitimer")
+    try:
+        try:
+            if alarm: signal.setitimer(signal.ITIMER_REAL, options['maxtime'] + GRACE)
+            hook = solver.jsonlines(fo, pack=packfile, level=idx) if fo else None
+            sol = solver.Solver(converda.workerlevels(packfile)[idx][1], hook=hook, **options)
+            moves = sol.solve(method)
+            result['status'] = sol.status
+        finally:
+            if alarm: signal.setitimer(signal.ITIMER_REAL, 0)
+    except Timeout:
+        result['status'] = 'limit'
+        result['error'] = "Stopped %ds after the deadline" % GRACE
+    except MemoryError:
+        result['status'] = 'memory'
+    except Exception as e: # e.g. level too big, no room for the spill files
+        result['status'] = 'error'
+        result['error'] = "%s: %s" % (type(e).__name__, e)
+    if fo: fo.close()
+    result['nodes'] = sol.nodes if sol else None
+    result['time'] = round(time.time() - start, 3)
+    if moves is not None:
+        grid = sol.start.copy()
+        result.update(moves=len(moves), pushes=sum(grid.move(d) for d in moves), solution=moves)
+    return result
+
+def readresults(path):
+    """{(packfile, levelindex): status} of all levels in a results file"""
+    done = {}
+    if not os.path.exists(path): return done
+    fo = open(path, "r")
+    for line in fo:
+        try:
+            rec = json.loads(line)
+            done[(rec['pack'], rec['level'])] = rec['status']
+        except (ValueError, KeyError, TypeError):
+            continue # broken record (killed while writing)
+    fo.close()
+    return done
+
+def main():
+    ap = argparse.ArgumentParser(description="Solve all unsolved levels of some or all packs. Can be killed and started again any time.")
+    ap.add_argument("-j", "--jobs", type=int, default=0, help="number of worker processes (default: one per CPU)")
+    ap.add_argument("-m", "--method", choices=("astar", "idastar", "anytime"), default="astar")
+    ap.add_argument("-w", "--weight", type=float, default=2.0, help="weight of the lower bound for anytime (default: %(default)s)")
+    ap.add_argument("-c", "--checkpoints", help="anytime: keep a checkpoint per level in this directory, --retry resumes from there")
+    ap.add_argument("-n", "--maxnodes", type=int, help="give up a level after expanding this many states")
+    ap.add_argument("-t", "--maxtime", type=float, default=60, help="give up a level after this many seconds (default: %(default)s)")
+    ap.add_argument("-M", "--maxmem", type=int, help="address space limit per worker in MB (not on windows), half of it for the closed set")
+    ap.add_argument("-o", "--output", default=os.path.join(sokoban.Sokoban.prf, "sokoban.batch.jsonl"), help="results file (default: %(default)s)")
+    ap.add_argument("--stats", help="write solver progress of all levels as JSON lines to this file")
+    ap.add_argument("-r", "--retry", action="store_true", help="try levels again which weren't solved in an earlier run")
+    ap.add_argument("levelzip", help="e.g. levels.zip")
+    ap.add_argument("packs", nargs="*", help="packfiles or their indizes (default: all)")
+    args = ap.parse_args()
+    jobs = args.jobs if args.jobs > 0 else multiprocessing.cpu_count()
+    memory = args.maxmem and args.maxmem << 19 # spill closed set to disk before the limit is hit
+
+    soko = sokoban.Sokoban(args.levelzip)
+    packfiles = [p['file'] for p in soko.packs]
+    packs = [packfiles.index(p) if p in packfiles else int(p) for p in args.packs] or range(len(packfiles))
+    if args.checkpoints and not os.path.isdir(args.checkpoints): os.makedirs(args.checkpoints)
+    done = readresults(args.output)
+    tasks = []
+    for pi in packs:
+        pa = soko.packs[pi]
+        for idx in range(len(pa['levels'])):
+            status = done.get((pa['file'], idx))
+            if status == 'solved' or (status and not args.retry): continue
+            # solved by someone else (a 'limit' of ours may have stored one, too)
+            if status is None and soko.solutions.summary(pa['file'], idx) is not None: continue
+            options = {'maxnodes': args.maxnodes, 'maxtime': args.maxtime, 'memory': memory, 'weight': args.weight}
+            if args.checkpoints:
+                name = "%s-%d.ckpt" % (soko.solutions.filename(pa['file'])[:-4], idx)
+                options['checkpoint'] = os.path.abspath(os.path.join(args.checkpoints, name))
+            tasks.append((pa['file'], idx, args.method, options, args.stats and os.path.abspath(args.stats)))
+    sys.stderr.write("%d levels to solve on %d processes\n" % (len(tasks), jobs))
+
+    # fresh process for each level: a big search can't leave a bloated worker behind
+    pool = multiprocessing.Pool(jobs, initworker, (soko.levelzip.filename, args.maxmem), maxtasksperchild=1)
+    fo = open(args.output, "a")
+    solved = 0
+    try:
+        for n, result in enumerate(pool.imap_unordered(solvelevel, tasks), 1):
+            if result['status'] == 'solved': solved += 1
+            known = soko.solutions.summary(result['pack'], result['level'])
+            if 'solution' in result and (known is None or result['moves'] < known['moves']):
+                pi = packfiles.index(result['pack'])
+                startframe = soko.packlevels(pi)[result['level']][1].rows()
+                soko.solutions.put(result['pack'], result['level'], (startframe, result['solution']))
+            fo.write(json.dumps(result, sort_keys=True) + "\n")
+            fo.flush()
+            sys.stderr.write("[%d/%d] %s %d: %s (%s nodes, %.1fs)\n" % (
+                n, len(tasks), result['pack'], result['level'], result['status'], result['nodes'], result['time']))
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate() # finished levels are on disk already
+        sys.stderr.write("Interrupted, %d levels solved\n" % solved)
+    else:
+        sys.stderr.write("%d of %d levels solved\n" % (solved, len(tasks)))
+    pool.join()
+    fo.close()
+
+if __name__ == '__main__':
+    main()
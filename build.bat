@@ -11,6 +11,7 @@ REM Since there is a bug with icon-embedding in py2exe, we also need ResoureceHa
 REM 7zip is also handy
 
 rmdir /Q /S iksokoban
+C:\Python27\python.exe levelarc.py levels.zip levels.arc
 C:\Python27\python.exe setup.py py2exe -q
 C:\tools\reshacker\ResourceHacker -open dist\pygameban.exe -save dist/iksokoban_gfx.exe -action add -res sprites\exeicon.ico -mask ICONGROUP,MAINICON,
 rename dist\ansiban.exe iksokoban_con.exe
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# closedset: die Menge der schon besuchten Stellungen für den Solver. Solange
+# sie in den erlaubten Speicher passt, ist sie ein dict. Danach wird das dict
+# sortiert auf die Platte geschrieben (ein "run") und geleert. Gesucht wird
+# erst im dict, dann per Binärsuche in den runs (per mmap). Langsamer, aber
+# der Prozess läuft nicht mehr voll.
+#
+# Run file: fixed size records (RECORD), sorted by key.
+
+import os, struct, mmap, heapq, shutil, tempfile
+
+class ClosedSet(object):
+    """
+    {key: (g, parent, push)}: key and parent are position keys (64 bit, see
+    FlatGrid.key()), g the number of pushes, push (cell, direction) or None.
+    'budget' is about the number of bytes the dict may use (None: no limit),
+    runs go to a temporary directory in 'directory'.
+    """
+    RECORD = struct.Struct("<QIQIB") # key, g, parent, cell, direction
+    ENTRY = 200 # estimated bytes per entry in the dict (tuples, ints, hash table)
+    MAXRUNS = 8 # merge runs if there are more
+    DIRS = "^v<>"
+    NOPUSH = 255
+
+    def __init__(self, budget=None, directory=None):
+        self.budget = budget
+        self.directory = directory
+        self.tmp = None # created on first spill
+        self.mem = {}
+        self.runs = [] # [(file, mmap, number of records), ...] oldest first
+        self.spilled = 0 # number of records on disk (including outdated ones)
+        self.serial = 0
+
+    def __len__(self): return len(self.mem) + self.spilled
+
+    def __contains__(self, key): return self.get(key) is not None
+
+    def get(self, key):
+        if key in self.mem: return self.mem[key]
+        for fo, mm, n in reversed(self.runs):
+            rec = self.search(mm, n, key)
+            if rec is not None: return self.value(rec)
+        return None
+
+    def items(self):
+        """yield (key, value) for all keys (merges runs first)"""
+        if len(self.runs) > 1: self.merge()
+        for item in self.mem.items(): yield item
+        for fo, mm, n in self.runs:
+            for i in range(n):
+                rec = self.RECORD.unpack_from(mm, i * self.RECORD.size)
+                if rec[0] not in self.mem: yield rec[0], self.value(rec)
+
+    def put(self, key, value):
+        self.mem[key] = value
+        if self.budget is not None and len(self.mem) * self.ENTRY > self.budget:
+            self.spill()
+
+    def search(self, mm, n, key):
+        """record with 'key' in a run by binary search, or None"""
+        size = self.RECORD.size
+        lo, hi = 0, n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            k = struct.unpack_from("<Q", mm, mid * size)[0]
+            if k < key: lo = mid + 1
+            elif k > key: hi = mid
+            else: return self.RECORD.unpack_from(mm, mid * size)
+        return None
+
+    def value(self, rec):
+        """(g, parent, push) of a record"""
+        g, parent, cell, d = rec[1:]
+        return g, parent, None if d == self.NOPUSH else (cell, self.DIRS[d])
+
+    def record(self, key, value):
+        g, parent, push = value
+        if push is None: return self.RECORD.pack(key, g, parent, 0, self.NOPUSH)
+        return self.RECORD.pack(key, g, parent, push[0], self.DIRS.index(push[1]))
+
+    def newrun(self, records):
+        """write sorted records (bytes) to a new run, returns (file, mmap, number)"""
+        if self.tmp is None: self.tmp = tempfile.mkdtemp(prefix="sokoban-closed-", dir=self.directory)
+        self.serial += 1
+        path = os.path.join(self.tmp, "%06d.run" % self.serial)
+        fo = open(path, "wb")
+        n = 0
+        for rec in records:
+            fo.write(rec)
+            n += 1
+        fo.close()
+        fo = open(path, "rb")
+        mm = mmap.mmap(fo.fileno(), 0, access=mmap.ACCESS_READ) if n else None
+        return fo, mm, n
+
+    def spill(self):
+        """write dict to a new run and empty it"""
+        if not self.mem: return
+        run = self.newrun(self.record(k, self.mem[k]) for k in sorted(self.mem))
+        self.runs.append(run)
+        self.spilled += run[2]
+        self.mem = {}
+        if len(self.runs) > self.MAXRUNS: self.merge()
+
+    def merge(self):
+        """merge all runs into one, newer records replace older ones"""
+        size = self.RECORD.size
+        def records(age, mm, n):
+            for i in range(n):
+                rec = mm[i * size:(i + 1) * size]
+                yield struct.unpack_from("<Q", rec)[0], age, rec
+        def newest(merged):
+            last = None
+            for key, age, rec in merged:
+                if key != last: yield rec # newest comes first (smallest age)
+                last = key
+        old = self.runs
+        merged = heapq.merge(*[records(-i, mm, n) for i, (fo, mm, n) in enumerate(old)])
+        run = self.newrun(newest(merged))
+        self.close(old)
+        self.runs = [run]
+        self.spilled = run[2]
+
+    def close(self, runs=None):
+        """close and delete runs (all of them and the directory if not given)"""
+        for fo, mm, n in (self.runs if runs is None else runs):
+            if mm is not None: mm.close()
+            fo.close()
+            os.remove(fo.name)
+        if runs is None:
+            self.runs = []
+            self.mem = {}
+            self.spilled = 0
+            if self.tmp: shutil.rmtree(self.tmp, True)
+            self.tmp = None
@@ -6,29 +6,108 @@
 # zu sparen.
 # und auch in die Gegenrichtung.
 
-import os, sys, json, gzip, sokoban
+import os, sys, json, gzip, codecs, zipfile, argparse, itertools, collections, multiprocessing, sokoban, solstore
+
+def findplayer(rows):
+    """(y, x) of the player in a frame given as rows"""
+    for y, row in enumerate(rows):
+        for x, cell in enumerate(row):
+            if cell & sokoban.Grid.SOKO: return y, x
+    raise ValueError("No player in frame")
 
 def stack2steps(grid):
+    """(startframe, moves) from a list of frames [[rows, pushes], ...]"""
     startframe = grid[0][0]
-    moves = "" # < v ^ >
-    for i in range(1, len(grid)):
-        # compare current frame with last one, find movement of gunther. We don't care for anthing else.
-        ty,tx = sokoban.Grid(grid[i][0]).findplayer()
-        oy,ox = sokoban.Grid(grid[i-1][0]).findplayer()
-        if tx < ox: moves += "<"
-        if tx > ox: moves += ">"
-        if ty < oy: moves += "^"
-        if ty > oy: moves += "v"
-    return (startframe, moves)
+    moves = [] # < v ^ >
+    SOKO = sokoban.Grid.SOKO
+    y, x = findplayer(startframe)
+    for frame in grid[1:]:
+        # only follow gunther, we don't care for anything else. He's either
+        # still at the same place or on one of the four cells next to it.
+        rows = frame[0]
+        if rows[y][x] & SOKO: continue
+        for d, (dy, dx) in sokoban.FlatGrid.OFFSET.items():
+            if 0 <= y+dy < len(rows) and 0 <= x+dx < len(rows[y+dy]) and rows[y+dy][x+dx] & SOKO:
+                moves.append(d)
+                y, x = y+dy, x+dx
+                break
+        else:
+            # teleported (broken replay?): search and record as before
+            ty, tx = findplayer(rows)
+            if tx < x: moves.append("<")
+            if tx > x: moves.append(">")
+            if ty < y: moves.append("^")
+            if ty > y: moves.append("v")
+            y, x = ty, tx
+    return (startframe, "".join(moves))
 
-def steps2stack(steps):
-    targ = [[steps[0],0]]
-    tg = sokoban.Grid(sokoban.Grid(steps[0]).copy())
+def itersteps(steps):
+    """yield frames [rows, pushes] of a solution (startframe, moves) one by one"""
+    yield [steps[0], 0]
+    tg = sokoban.FlatGrid(steps[0])
     lp = 0 # puhed-counter
     for s in steps[1]:
         lp += tg.move(s)
-        targ.append([tg.copy(), lp])
-    return targ
+        yield [tg.rows(), lp]
+
+def steps2stack(steps):
+    return list(itersteps(steps))
+
+class Reader(object):
+    """
+    Read a big JSON object piece by piece from a file, so the whole thing
+    never has to be in memory (json.load would need several times its size).
+    """
+    CHUNK = 1 << 20
+
+    def __init__(self, fo):
+        self.fo = codecs.getreader("utf-8")(fo)
+        self.decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+
+    def more(self):
+        # read at least as much as is pending, so reparsing a big value stays linear
+        data = self.fo.read(max(self.CHUNK, len(self.buf) - self.pos))
+        if not data: raise ValueError("Unexpected end of file")
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+
+    def peek(self):
+        """next non-whitespace character"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n": self.pos += 1
+            if self.pos < len(self.buf): return self.buf[self.pos]
+            self.more()
+
+    def expect(self, c):
+        if self.peek() != c: raise ValueError("Expected %s at %r" % (c, self.buf[self.pos:self.pos+20]))
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                val, self.pos = self.decoder.raw_decode(self.buf, self.pos)
+                return val
+            except ValueError:
+                self.more()
+
+    def items(self, depth=2):
+        """
+        yield (key, ..., value) for the objects nested 'depth' levels deep,
+        e.g. (packfile, levelindex, solution) for a solution file
+        """
+        self.expect("{")
+        while self.peek() != "}":
+            key = self.value()
+            self.expect(":")
+            if depth > 1:
+                for item in self.items(depth - 1): yield (key,) + item
+            else:
+                yield (key, self.value())
+            if self.peek() == ",": self.pos += 1
+        self.pos += 1
 
 def prettyjson(sol):
     # pretty print for human beings <3
@@ -41,27 +120,190 @@ def prettyjson(sol):
     ws = ws.replace('"], "', '"],\n    "') # next level
     return ws
 
-def main():
-    if len(sys.argv) < 3: 
-        sys.stderr.write("Usage: %s <sokoban.solutions.jgz> <sokoban.solutions.hgz>\n" % sys.argv[0])
-    
-    fo = gzip.open(sys.argv[1], 'r')
-    solutions = json.load(fo)
-    fo.close()
-    
-    solnu = {}
-    for kk in solutions.keys():
-        pack = solutions[kk]
+def convertpack(pack):
+    """(packfile, {levelindex: solution}) from (packfile, [(levelindex, stack), ...])"""
+    return pack[0], dict((pp, stack2steps(stack)) for pp, stack in pack[1])
+
+def ordered(pool, func, tasks, ahead):
+    """
+    like pool.imap, but only 'ahead' tasks are pending at any time (imap would
+    read all of them at once, i.e. the whole solutions file)
+    """
+    pending = collections.deque()
+    for task in tasks:
+        pending.append(pool.apply_async(func, (task,)))
+        if len(pending) >= ahead: yield pending.popleft().get()
+    while pending: yield pending.popleft().get()
+
+def readsolutions(source):
+    """
+    yield (packfile, {levelindex: solution}) for each pack in 'source', which is
+    a solutions file (frames or steps, gzipped JSON) or a directory of journals
+    (see solstore). Solutions are returned as stored.
+    """
+    if os.path.isdir(source):
+        store = solstore.SolutionStore(source, readonly=True) # don't touch what is checked
+        for packfile in store.packfiles():
+            levels = store.pack(packfile)
+            if levels: yield packfile, dict((idx, sol[:2]) for idx, sol in levels.items())
+        return
+    fi = gzip.open(source, 'r')
+    for kk, pack in itertools.groupby(Reader(fi).items(), lambda item: item[0]):
+        yield kk, dict((pp, sol) for kk, pp, sol in pack)
+    fi.close()
+
+LEVELZIP = None # open levels.zip of a worker process (see initworker)
+PACKS = None # parsed packs of a worker process {packfile: [(str, FlatGrid), ...]}
+
+def initworker(levelzip):
+    global LEVELZIP, PACKS
+    LEVELZIP = zipfile.ZipFile(levelzip)
+    PACKS = sokoban.LRU(4)
+
+def workerlevels(packfile):
+    """levels [(str, FlatGrid), ...] of a pack in a worker process ([] if there is no such pack)"""
+    levels = PACKS.get(packfile)
+    if levels is None:
+        try:
+            levels = sokoban.readpack(LEVELZIP, packfile, verbose=False)['levels']
+        except KeyError:
+            levels = []
+        PACKS.put(packfile, levels)
+    return levels
+
+def verify(level, solution):
+    """
+    replay solution (startframe, moves) on level (FlatGrid).
+    returns {'status': str, 'moves': int, 'pushes': int} and 'error' if status is not 'ok'
+    """
+    result = {'status': 'ok', 'moves': len(solution[1]), 'pushes': 0}
+    try:
+        grid = sokoban.FlatGrid(solution[0])
+    except (AssertionError, TypeError, ValueError) as e:
+        result.update(status='invalid', error="Broken startframe: %s" % e)
+        return result
+    if grid.width != level.width or grid.cells != level.cells:
+        result.update(status='mismatch', error="Startframe differs from level")
+        return result
+    for i, d in enumerate(solution[1]):
+        pushed = grid.move(d) if d in grid.OFFSET else None
+        if pushed is None:
+            result.update(status='invalid', error="Invalid move %d (%s)" % (i, d))
+            return result
+        result['pushes'] += pushed
+    if not grid.iswin():
+        result.update(status='nowin', error="%d crates not on a target" % grid.todo)
+    return result
+
+def verifypack(task):
+    """check all solutions of one pack: [{'source', 'pack', 'level', 'status', ...}, ...]"""
+    source, packfile, solutions = task
+    levels = workerlevels(packfile)
+    report = []
+    for idx in sorted(solutions, key=lambda idx: int(idx) if str(idx).isdigit() else -1):
+        sol = solutions[idx]
+        try:
+            if sol and isinstance(sol[1], list):
+                sol = stack2steps(sol) # old file, one frame per move
+            if not 0 <= int(idx) < len(levels):
+                result = {'status': 'nolevel', 'moves': len(sol[1]), 'pushes': None, 'error': "No such level"}
+            else:
+                result = verify(levels[int(idx)][1], sol)
+        except Exception as e: # whatever someone merged in, it's just not a solution
+            result = {'status': 'invalid', 'moves': None, 'pushes': None, 'error': "Broken entry: %r" % e}
+        result.update(source=source, pack=packfile, level=idx)
+        report.append(result)
+    return report
+
+def convert(infile, outfile, jobs):
+    # one pack at a time: memory doesn't grow with the size of the file
+    fi = gzip.open(infile, 'r')
+    fo = gzip.open(outfile, 'w')
+    fo.write(b"{")
+    first = True
+    packs = itertools.groupby(Reader(fi).items(), lambda item: item[0])
+    pool = multiprocessing.Pool(jobs) if jobs > 1 else None
+    if pool:
+        tasks = ((kk, [(pp, stack) for kk, pp, stack in pack]) for kk, pack in packs)
+        packs = ordered(pool, convertpack, tasks, 2 * jobs)
+    for kk, pack in packs:
         sys.stdout.write("%s: " % kk)
-        solnu[kk] = {}
-        for pp in pack.keys():
-            solnu[kk][pp] = stack2steps(pack[pp])
-            sys.stdout.write("%s | " % pp)
-            sys.stdout.flush()
+        if pool:
+            solnu = pack # already converted
+            sys.stdout.write("%d levels" % len(solnu))
+        else:
+            solnu = {}
+            for kk, pp, stack in pack:
+                solnu[pp] = stack2steps(stack)
+                sys.stdout.write("%s | " % pp)
+                sys.stdout.flush()
         sys.stdout.write("\n")
-    fo = gzip.open(sys.argv[2], 'w')
-    fo.write(prettyjson(solnu).encode("ascii"))
+        if not first: fo.write(b",\n\n")
+        fo.write(prettyjson({kk: solnu})[1:-1].encode("ascii"))
+        first = False
+    if pool:
+        pool.close()
+        pool.join()
+    fo.write(b"}")
     fo.close()
+    fi.close()
+
+def check(sources, levelzip, jobs, report):
+    """
+    Replay all solutions of all sources against the levels in levelzip and
+    write one JSON line for each invalid, not winning or suboptimal (more
+    moves than the best valid one of all sources) solution to 'report'.
+    returns number of solutions per status {status: int}
+    """
+    tasks = ((source, packfile, levels) for source in sources for packfile, levels in readsolutions(source))
+    pool = multiprocessing.Pool(jobs, initworker, (levelzip,)) if jobs > 1 else None
+    if pool:
+        results = ordered(pool, verifypack, tasks, 2 * jobs)
+    else:
+        initworker(levelzip)
+        results = (verifypack(task) for task in tasks)
+    best = {} # {(packfile, levelindex): moves}
+    valid = [] # only these may turn out suboptimal
+    count = collections.Counter()
+    for pack in results:
+        for result in pack:
+            if result['status'] != 'ok':
+                count[result['status']] += 1
+                report.write(json.dumps(result, sort_keys=True) + "\n")
+                continue
+            key = (result['pack'], result['level'])
+            best[key] = min(best.get(key, result['moves']), result['moves'])
+            valid.append(result)
+    if pool:
+        pool.close()
+        pool.join()
+    for result in valid:
+        moves = best[(result['pack'], result['level'])]
+        if result['moves'] > moves:
+            result.update(status='suboptimal', best=moves)
+            report.write(json.dumps(result, sort_keys=True) + "\n")
+        count[result['status']] += 1
+    return count
+
+def main():
+    ap = argparse.ArgumentParser(description="Convert solutions from one frame per move to startframe and moves, or check solutions.")
+    ap.add_argument("-j", "--jobs", type=int, default=1, help="number of worker processes (0: one per CPU)")
+    ap.add_argument("-c", "--check", action="store_true", help="replay solutions against the levels and report broken or suboptimal ones")
+    ap.add_argument("-l", "--levels", default=os.path.join(sokoban.Sokoban.PREFIX, "levels.zip"), help="levelzip to check against (default: %(default)s)")
+    ap.add_argument("-o", "--output", help="write check report (JSON lines) to this file instead of stdout")
+    ap.add_argument("files", nargs="+", help="<sokoban.solutions.jgz> <sokoban.solutions.hgz> or, with --check, any number of solution files or directories")
+    args = ap.parse_args()
+    jobs = args.jobs if args.jobs > 0 else multiprocessing.cpu_count()
+
+    if not args.check:
+        if len(args.files) != 2: ap.error("convert needs exactly two files")
+        convert(args.files[0], args.files[1], jobs)
+        return
+    report = open(args.output, "w") if args.output else sys.stdout
+    count = check(args.files, args.levels, jobs, report)
+    if report is not sys.stdout: report.close()
+    sys.stderr.write("%d solutions: %s\n" % (sum(count.values()), ", ".join("%d %s" % (n, s) for s, n in sorted(count.items()))))
+    if set(count) - set(["ok"]): sys.exit(1)
 
 if __name__ == '__main__':
     main()
@@ -1,8 +1,8 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import pygame, zlib, base64, io, time
-from sokoban import Grid
+import pygame, zlib, base64, io, time, threading
+from sokoban import Grid, LRU
 
 
 colors = {
@@ -58,6 +58,39 @@ def mapsprites():
             ])
             v.set_colorkey((255,0,255))
         sprites[k] = v.convert()
+    with ATLASLOCK:
+        ATLAS.clear()
+
+ATLAS = LRU(8) # {zoom: {key: sprite}}, see atlas()
+ATLASLOCK = threading.Lock() # previews are drawn in another thread
+
+def atlas(zoom, cache=True):
+    """
+    all sprites scaled by 'zoom' {key: Surface}, built once per zoom.
+    Integer zoom without interpolation, any other zoom smooth (with alpha).
+    Without 'cache' it's built every time and not kept (for one-off zooms,
+    which would push the playfield's zoom out of ATLAS).
+    """
+    with ATLASLOCK:
+        return scaledsprites(zoom, cache)
+
+def scaledsprites(zoom, cache=True):
+    scaled = ATLAS.get(zoom)
+    if scaled is None:
+        scaled = {}
+        for k, v in sprites.items():
+            w, h = v.get_size()
+            if zoom == 1: pass
+            elif zoom == int(zoom): v = pygame.transform.scale(v, (int(zoom) * w, int(zoom) * h))
+            else:
+                # transparent pixels black (not the colorkey), so interpolated edges don't get pink
+                clear = pygame.Surface((w, h), pygame.SRCALPHA)
+                clear.fill((0, 0, 0, 0))
+                clear.blit(v, (0, 0))
+                v = pygame.transform.smoothscale(clear, (int(zoom * w + 0.5), int(zoom * h + 0.5)))
+            scaled[k] = v
+        if cache: ATLAS.put(zoom, scaled)
+    return scaled
 
 def importsprites():
     import sys.stdout.write as wr
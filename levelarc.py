@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# levelarc: "kompiliert" alle Levels eines levels.zip in ein einziges
+# Binärarchiv. Das wird per mmap geöffnet und jedes Level kann einzeln geladen
+# werden, ohne ein ganzes Pack zu entpacken und zu parsen.
+#
+# Layout (little endian):
+#   HEADER | PACK * npacks | LEVEL * nlevels | strings & cells
+# Strings are utf-8, prefixed with their length (H). Cells are stored as in
+# FlatGrid (one byte per cell, row by row), so a level is just one slice.
+
+import os, sys, struct, mmap, zlib, zipfile, sokoban, solstore
+
+MAGIC = b"IKSOKAR1"
+HEADER = struct.Struct("<8sIIII") # magic, zip size, zipsum(), number of packs, number of levels
+PACK = struct.Struct("<IIII")     # file (string), title (string), first level, number of levels
+LEVEL = struct.Struct("<IIHH")    # name (string), cells, width, height
+
+def zipsum(levelzip):
+    """checksum over names and CRCs of all packs in an open ZipFile"""
+    crc = 0
+    for fi in levelzip.infolist():
+        if fi.filename.endswith(".txt"):
+            crc = zlib.crc32(("%s:%d;" % (fi.filename, fi.CRC)).encode("utf-8"), crc)
+    return crc & 0xffffffff
+
+def build(levelzip, target):
+    """
+    compile all packs of an open ZipFile into archive 'target' (in the order
+    Sokoban lists them). It's written next to it and renamed, as the old one
+    may still be mapped by a running game.
+    """
+    packs = []
+    levels = []
+    data = bytearray()
+    def string(s):
+        """append string to data, return its offset"""
+        s = s.encode("utf-8")
+        data.extend(struct.pack("<H", len(s)))
+        data.extend(s)
+        return len(data) - len(s) - 2
+    for fi in levelzip.infolist():
+        if not fi.filename.endswith(".txt"): continue
+        pug = sokoban.readpack(levelzip, fi.filename, verbose=False)
+        packs.append((string(pug['file']), string(pug['title']), len(levels), len(pug['levels'])))
+        for name, grid in pug['levels']:
+            levels.append((string(name), len(data), grid.width, grid.height))
+            data.extend(grid.cells)
+    start = HEADER.size + PACK.size * len(packs) + LEVEL.size * len(levels)
+    fo = open(target + ".tmp", "wb")
+    fo.write(HEADER.pack(MAGIC, os.path.getsize(levelzip.filename), zipsum(levelzip), len(packs), len(levels)))
+    for fn, ti, first, num in packs:
+        fo.write(PACK.pack(start + fn, start + ti, first, num))
+    for na, ce, w, h in levels:
+        fo.write(LEVEL.pack(start + na, start + ce, w, h))
+    fo.write(data)
+    fo.close()
+    solstore.replace(target + ".tmp", target)
+    return len(packs), len(levels)
+
+
+class Archive(object):
+    """Read-only access to a compiled archive."""
+    def __init__(self, filename):
+        self.fo = open(filename, "rb")
+        self.mm = mmap.mmap(self.fo.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.zipsize, self.zipsum, self.npacks, self.nlevels = HEADER.unpack_from(self.mm, 0)
+        assert magic == MAGIC, "%s is no level archive" % filename
+        self.levelstart = HEADER.size + PACK.size * self.npacks
+
+    def matches(self, levelzip):
+        """was this archive compiled from (this version of) levelzip?"""
+        return os.path.getsize(levelzip.filename) == self.zipsize and zipsum(levelzip) == self.zipsum
+
+    def string(self, offset):
+        ln, = struct.unpack_from("<H", self.mm, offset)
+        return self.mm[offset+2:offset+2+ln].decode("utf-8")
+
+    def packs(self):
+        """list of packs like Sokoban.packs, levels are loaded on demand (see Pack)"""
+        result = []
+        for i in range(self.npacks):
+            fn, ti, first, num = PACK.unpack_from(self.mm, HEADER.size + PACK.size * i)
+            result.append({'file': self.string(fn), 'title': self.string(ti), 'levels': Pack(self, first, num)})
+        return result
+
+    def level(self, idx):
+        """(name, FlatGrid) of level idx (counted over all packs)"""
+        na, ce, w, h = LEVEL.unpack_from(self.mm, self.levelstart + LEVEL.size * idx)
+        return self.string(na), sokoban.FlatGrid(self.mm[ce:ce+w*h], w)
+
+    def close(self):
+        self.mm.close()
+        self.fo.close()
+
+
+class Pack(object):
+    """Sequence of (name, FlatGrid) for one pack, each one is read when accessed."""
+    def __init__(self, archive, first, num):
+        self.archive = archive
+        self.first = first
+        self.num = num
+
+    def __len__(self): return self.num
+
+    def __getitem__(self, idx):
+        if idx < 0: idx += self.num
+        if not 0 <= idx < self.num: raise IndexError("No level %d" % idx)
+        return self.archive.level(self.first + idx)
+
+
+def main():
+    if len(sys.argv) < 3:
+        sys.stderr.write("Usage: %s <levels.zip> <levels.arc>\n" % sys.argv[0])
+        return
+    # no Sokoban here: it would map the old archive and touch savegame and solutions
+    levelzip = zipfile.ZipFile(sys.argv[1])
+    sys.stdout.write("%d packs, %d levels written to %s\n" % (build(levelzip, sys.argv[2]) + (sys.argv[2],)))
+    levelzip.close()
+
+if __name__ == '__main__':
+    main()
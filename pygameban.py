@@ -9,13 +9,94 @@
 # Und weil auch eine Programmierübung ist, ist alles python 2 & 3 kompatibel :-)
 from __future__ import unicode_literals
 
-import pygame, random, re, time, os
+import pygame, random, re, time, os, hashlib, threading
 
-import gfx
+import gfx, solstore
 from sokoban import *
 
 DEFAULT_SIZE = (800, 600)
 
+class Thumbnails(object):
+    """
+    Previews of levels, drawn in a background thread. want() tells it which
+    ones are needed next (most wanted first), get() returns one if it's done
+    already. The last 'maxsize' are kept in memory and, if a 'directory' is
+    given, the last 'maxfiles' on disk as png (named by key, see
+    Pygameban.thumbkey()). When the preview get() missed last is done, an
+    'event' with its key is posted.
+    """
+    def __init__(self, render, maxsize, directory=None, event=None, maxfiles=1000):
+        self.render = render # render(grid, dim) -> Surface
+        self.cache = LRU(maxsize)
+        self.directory = directory
+        self.maxfiles = maxfiles
+        self.event = event
+        self.wanted = [] # [(key, grid, dim), ...]
+        self.waiting = None # key get() missed last
+        self.cond = threading.Condition()
+        if directory and not os.path.isdir(directory): os.makedirs(directory)
+        th = threading.Thread(target=self.work)
+        th.daemon = True
+        th.start()
+    
+    def get(self, key):
+        with self.cond:
+            srf = self.cache.get(key)
+            if srf is None: self.waiting = key
+            return srf
+    
+    def want(self, jobs):
+        """replace the list of wanted previews [(key, grid, dim), ...]"""
+        with self.cond:
+            self.wanted = [job for job in jobs if job[0] not in self.cache]
+            self.cond.notify()
+    
+    def work(self):
+        self.prune()
+        while True:
+            with self.cond:
+                while not self.wanted: self.cond.wait()
+                key, grid, dim = self.wanted.pop(0)
+                if key in self.cache: continue
+            srf = self.load(key)
+            if srf is None:
+                srf = self.render(grid, dim)
+                self.save(key, srf)
+            with self.cond:
+                self.cache.put(key, srf)
+                waiting = self.waiting == key
+            if waiting and self.event: pygame.event.post(pygame.event.Event(self.event, key=key))
+    
+    def path(self, key):
+        return os.path.join(self.directory, key + ".png")
+    
+    def load(self, key):
+        if not self.directory or not os.path.exists(self.path(key)): return None
+        try:
+            srf = pygame.image.load(self.path(key))
+            os.utime(self.path(key), None) # used: prune() keeps it
+            return srf
+        except (pygame.error, OSError):
+            return None # broken file, draw it again
+    
+    def prune(self):
+        """remove all but the last used 'maxfiles' previews from the directory"""
+        if not self.directory: return
+        try:
+            files = [os.path.join(self.directory, f) for f in os.listdir(self.directory) if f.endswith(".png")]
+            files.sort(key=os.path.getmtime, reverse=True)
+            for f in files[self.maxfiles:]: os.remove(f)
+        except OSError as e:
+            sys.stderr.write("Cannot clean up previews: %s\n" % e)
+    
+    def save(self, key, srf):
+        if not self.directory: return
+        try:
+            pygame.image.save(srf, self.path(key + ".tmp")) # extension tells the format
+            solstore.replace(self.path(key + ".tmp"), self.path(key))
+        except (pygame.error, IOError, OSError) as e:
+            sys.stderr.write("Cannot save preview %s: %s\n" % (key, e))
+
 class Pygameban:
     """Eye-friendly oldschool-GFX with pygame"""
     # classvars are config. may be set on runtime?
@@ -27,6 +108,13 @@ class Pygameban:
     STATUS = 23 # Number of text rows. (height / STATUS) is row height.
     BORDER = 2
     REPEAT = (200,90) # key repeat delay and interval. set to (0,0) to deactivate keyrepeat
+    TEXTCACHE = 512 # number of rendered texts to keep
+    ROWCACHE = 64 # number of rendered menu rows to keep
+    THUMBCACHE = 64 # number of level previews to keep in memory
+    THUMBDIR = os.path.join(Sokoban.prf, "sokoban.thumbs") # previews on disk. None: don't keep them
+    THUMBFILES = 1000 # number of previews to keep on disk (the last used ones)
+    PREFETCH = 10 # draw previews of this many levels before and after the selected one
+    GLYPHS = '0123456789,.:/-+ ' # texts made of these only are drawn glyph by glyph (counters)
     
     def __init__(self, leveldir):
         pygame.init()
@@ -34,6 +122,11 @@ class Pygameban:
         # in case of multihead, this is too large (all monitors instead of one)
         self.disp = (di.current_w, di.current_h)
         self.curr = DEFAULT_SIZE
+        self.static = None # static layer of the current level, see layer()
+        self.shown = None # what playfield() has drawn last, None = something else
+        self.texts = LRU(self.TEXTCACHE) # {(text, color, fontsize): Surface}
+        self.glyphs = {} # {color: {char: Surface}} for GLYPHS
+        self.setmenu(0, None, None)
         pygame.font.init()
         pygame.display.set_caption('IKSOKOBAN')
         pygame.display.set_icon(gfx.icon())
@@ -45,7 +138,7 @@ class Pygameban:
         pygame.key.set_repeat(*self.REPEAT)
         self.soko = Sokoban(leveldir)
         self.menuselect = 0 # selected row in current menu
-        self.menulist = [] # a list of dicts (pygame.Surface(), func, args, next-state (see main))
+        self.maxlevels = max(len(p['levels']) for p in self.soko.packs) # widest number in pack menu
         self.currsol = None # last solution metadata (moves, pushes)
         # states
         # 0 = exit
@@ -68,26 +161,55 @@ class Pygameban:
                 self.font = pygame.font.Font(pygame.font.get_default_font(), fontsize)
         else:
             self.font = pygame.font.SysFont(None, fontsize)
+        self.fontsize = fontsize
+        self.texts.clear()
+        self.glyphs = {}
+        self.rows.clear()
         self.curr = (w, h)
+        self.shown = None
+    
+    def render(self, s, color):
+        """text 's' rendered in a named 'color', cached"""
+        key = (s, color, self.fontsize)
+        fs = self.texts.get(key)
+        if fs is None:
+            tcol = gfx.colors['gfont'] if 'gfont' in gfx.colors else gfx.colors[color]
+            fs = self.font.render(s, self.FONTAA, tcol)
+            self.texts.put(key, fs)
+        return fs
+    
+    def glyphatlas(self, color):
+        """{char: Surface} all GLYPHS rendered in a named 'color' (once per font size)"""
+        atlas = self.glyphs.get(color)
+        if atlas is None:
+            atlas = dict((c, self.render(c, color)) for c in self.GLYPHS)
+            self.glyphs[color] = atlas
+        return atlas
     
     def text(self, s, coord, color, surface=None):
         """
         draw text 's' to an existing 'surface' or screen (if no surface given) at
         'coord' with a named 'color' (see gfx.colors.keys())
+        Texts made of GLYPHS only (moves, pushes, time) are put together from
+        single glyphs, they change too often to be worth caching.
         returns the width (pixel) of the rendered text
         """
         if surface is None: surface = self.screen
         sth = self.screen.get_height() // self.STATUS # zeilenhöhe
-        tcol = gfx.colors[color]
-        tbg = None
-        if 'gfont' in gfx.colors: tcol = gfx.colors['gfont']
-        fs = self.font.render(s, self.FONTAA, tcol)
+        if s and all(c in self.GLYPHS for c in s):
+            atlas = self.glyphatlas(color)
+            fs = [atlas[c] for c in s]
+        else:
+            fs = [self.render(s, color)]
         # center text vertically
-        hi = fs.get_height()
+        hi = fs[0].get_height()
         if hi < sth: coord = (coord[0], coord[1] + (sth-hi)//2 + (sth-hi)%2)
         
-        surface.blit(fs, coord)
-        return fs.get_width()
+        x = coord[0]
+        for g in fs:
+            surface.blit(g, (x, coord[1]))
+            x += g.get_width()
+        return x - coord[0]
     
     def modal(self, txt):
         """display a modal dialog, wait for a key and return it"""
@@ -109,6 +231,7 @@ class Pygameban:
             he += self.font.get_linesize()
         # blit centered to screen
         self.screen.blit(ms, ((self.screen.get_width() - ms.get_width()) // 2, (self.screen.get_height() - ms.get_height()) // 2))
+        self.shown = None
         pygame.display.flip()
         
     def waitkey(self, waitkeys=None):
@@ -120,7 +243,34 @@ class Pygameban:
                 ev = None
         return ev.key
     
-    def plot(self, dim=(0,0), minfield=(20,17), border=2, floatzoom=False):
+    def spritekey(self, col, facing=None):
+        """key in gfx.sprites for a cell with content 'col' (player faces 'facing' or lastdir)"""
+        if col & Grid.SOKO:
+            if facing is None: facing = self.lastdir
+            if facing == '<': return 'sokoleft'
+            if facing == '>': return 'sokoright'
+            return 'sokovert'
+        return col
+    
+    def geometry(self, grid, border):
+        """
+        1:1 layout of 'grid' with a 'border' (16x12 each block):
+        returns (size of the whole picture, offset of the first block, border rect)
+        """
+        gw = grid.width
+        gh = grid.height
+        # border offset left and top
+        bleft = border - 6
+        btop = border - 4
+        off = border if border > 6 else border-bleft, border if border > 4 else border-btop
+        size = (
+            16*gw+6+(-bleft if bleft < 0 else 0)+border+max(bleft,0), 
+            12*gh+4+(-bleft if btop  < 0 else 0)+border+max(btop,0)
+        )
+        frame = (-bleft if bleft < 0 else 0, -btop if btop < 0 else 0, gw*16+6+2*border, gh*12+2*border)
+        return size, off, frame
+    
+    def plot(self, dim=(0,0), minfield=(20,17), border=2, floatzoom=False, grid=None, facing=None, cache=True):
         """
         plot current playfield into a surface with given 'dim'ensions.
         If dim is (0,0) zoom = 1 (16x12 each block) will be used. 
@@ -129,78 +279,168 @@ class Pygameban:
         Draw playfield with at least 'minsize' blocks size and center it in dim.
         If floatzoom is false, only integer zoomlevels are used and no 
         interpolation.
+        The blocks are drawn at their final size (see gfx.atlas()), nothing
+        is scaled afterwards.
+        Another 'grid' than the current one and the direction the player is
+        'facing' may be given (see spritekey()), 'cache' is passed to gfx.atlas().
         
         returns a surface with all the blocks in place
         """
-        # grid size
-        gw = self.soko.currentgrid.width
-        gh = self.soko.currentgrid.height
-        # border offset left and top
-        bleft = border - 6
-        btop = border - 4
-        off = border if border > 6 else border-bleft, border if border > 4 else border-btop
-        # plot 1:1 with border
-        targ = pygame.Surface((
-            16*gw+6+(-bleft if bleft < 0 else 0)+border+max(bleft,0), 
-            12*gh+4+(-bleft if btop  < 0 else 0)+border+max(btop,0)
-        ), pygame.SRCALPHA)
-        # draw border of playfield
-        targ.fill(gfx.colors['border'], (-bleft if bleft < 0 else 0, -btop if btop < 0 else 0, gw*16+6+2*border, gh*12+2*border))
-        # draw playfield items
-        targ.fill(gfx.colors['bg2'], off + (gw*16+3, gh*12))
-        for rc, row in enumerate(self.soko.currentgrid.grid):
-            for cc, col in enumerate(row):
-                if col == 0: continue
-                if col & Grid.SOKO:
-                    # TODO: richtungsabhängig
-                    if self.lastdir == '<': spr = gfx.sprites['sokoleft']
-                    elif self.lastdir == '>': spr = gfx.sprites['sokoright']
-                    else: spr = gfx.sprites['sokovert']
-                else:
-                    spr = gfx.sprites[col]
-                targ.blit(spr, (off[0]-5+16*cc, off[1]-4+12*rc))
-        # resize and pad to target size
-        if dim == (0,0): dim = (targ.get_width(), targ.get_height())
-        zoom = min(float(dim[0]) / max(targ.get_width(), minfield[0]*16), float(dim[1]) / max(targ.get_height(), minfield[1]*12))
-        if not floatzoom:
-            zoom = int(zoom)
-            if zoom > 1:
-                targ = pygame.transform.scale(targ, (zoom * min(targ.get_width(), dim[0]), zoom * min(targ.get_height(), dim[1])))
-        else:
-            targ = pygame.transform.smoothscale(targ, (int(zoom * targ.get_width()), int(zoom * targ.get_height())))
+        if grid is None: grid = self.soko.currentgrid
+        size = self.geometry(grid, border)[0]
+        if dim == (0,0): dim = size
+        zoom = min(float(dim[0]) / max(size[0], minfield[0]*16), float(dim[1]) / max(size[1], minfield[1]*12))
+        if not floatzoom: zoom = max(int(zoom), 1)
+        scaled = (int(zoom * size[0]), int(zoom * size[1]))
         # extend in the other direction (probably)
-        result = pygame.Surface((max(dim[0], targ.get_width()), max(dim[1], targ.get_height())), pygame.SRCALPHA)
-        result.blit(targ, ((dim[0] - targ.get_width())//2, (dim[1] - targ.get_height())//2))
+        result = pygame.Surface((int(max(dim[0], scaled[0])), int(max(dim[1], scaled[1]))), pygame.SRCALPHA)
+        self.draw(result, grid, zoom, (int(dim[0] - scaled[0])//2, int(dim[1] - scaled[1])//2), border, facing=facing, cache=cache)
         return result
-        
+    
+    def locate(self, grid, zoom, origin, border):
+        """function giving the position of the sprite of cell i of 'grid' drawn at 'origin'"""
+        gw = grid.width
+        off = self.geometry(grid, border)[1]
+        def pos(i):
+            rc, cc = divmod(i, gw)
+            return origin[0] + int(zoom * (off[0]-5+16*cc)), origin[1] + int(zoom * (off[1]-4+12*rc))
+        return pos
+    
+    def draw(self, surface, grid, zoom, origin, border, mask=0xff, facing=None, cache=True):
+        """
+        draw 'grid' with a 'border' into 'surface', top left corner at 'origin',
+        each block zoom*16 x zoom*12. Only the bits of each cell in 'mask' are
+        drawn (0: just border and floor), the player faces 'facing' (see spritekey()).
+        'cache': keep the sprites at this zoom, see gfx.atlas().
+        """
+        size, off, frame = self.geometry(grid, border)
+        # everything is cut off at the size of the picture
+        picture = pygame.Rect(origin, (int(zoom * size[0]), int(zoom * size[1]))).clip(surface.get_rect())
+        def rect(x, y, w, h):
+            return pygame.Rect(origin[0] + int(zoom * x), origin[1] + int(zoom * y), int(zoom * w), int(zoom * h)).clip(picture)
+        pos = self.locate(grid, zoom, origin, border)
+        sprites = gfx.atlas(zoom, cache)
+        clip = surface.get_clip()
+        surface.set_clip(picture)
+        # draw border of playfield
+        surface.fill(gfx.colors['border'], rect(*frame))
+        # draw playfield items
+        surface.fill(gfx.colors['bg2'], rect(off[0], off[1], grid.width*16+3, grid.height*12))
+        for i, col in enumerate(grid.cells):
+            col &= mask
+            if col: surface.blit(sprites[self.spritekey(col, facing)], pos(i))
+        surface.set_clip(clip)
+    
+    def layer(self, field):
+        """
+        static layer of the current level for the playfield area 'field' (Rect):
+        border, floor, walls and targets composed once at screen resolution.
+        Kept until the level or the size changes. A dict:
+        'static': the layer, 'base': the same without walls and targets,
+        'sprites': gfx.atlas() of the zoom, 'pos': screen position of the
+        sprite of a cell, 'box': size of the area every sprite of a cell fits in
+        """
+        key = (self.soko.packinfo['idx'], self.soko.levelinfo['idx'], tuple(field))
+        if self.static and self.static['key'] == key: return self.static
+        grid = self.soko.currentgrid
+        size = self.geometry(grid, self.BORDER)[0]
+        # same zoom as plot() in playfield: integer if possible, float if the level is too big
+        zoom = min(float(field.w) / max(size[0], 20*16), float(field.h) / max(size[1], 17*12))
+        if zoom >= 1: zoom = int(zoom)
+        origin = ((field.w - int(zoom * size[0])) // 2, (field.h - int(zoom * size[1])) // 2)
+        base = pygame.Surface(field.size).convert()
+        base.fill(gfx.colors['bg1'])
+        self.draw(base, grid, zoom, origin, self.BORDER, 0)
+        static = base.copy()
+        self.draw(static, grid, zoom, origin, self.BORDER, Grid.WALL | Grid.TARGET)
+        self.static = {
+            'key': key, 'field': field, 'static': static, 'base': base, 'sprites': gfx.atlas(zoom),
+            'pos': self.locate(grid, zoom, (field.x + origin[0], field.y + origin[1]), self.BORDER),
+            'box': (int(zoom * 24 + 0.5), int(zoom * 16 + 0.5)) # biggest sprite is 24x16
+        }
+        return self.static
+    
+    def changed(self, shown, grid):
+        """cells of 'grid' which differ from the last frame 'shown' (which is updated)"""
+        old, new, w = shown['cells'], grid.cells, grid.width
+        dirty = []
+        # a move, undo or redo only changes cells next to the player (before or after)
+        for p in set((shown['player'], grid.player)):
+            for i in (p, p-1, p-2, p+1, p+2, p-w, p-2*w, p+w, p+2*w):
+                if 0 <= i < len(new) and old[i] != new[i]:
+                    dirty.append(i)
+                    old[i] = new[i]
+        if old != new: # restart or a jump in replay: compare everything
+            dirty.extend(i for i in range(len(new)) if old[i] != new[i])
+            shown['cells'] = bytearray(new)
+        if shown['lastdir'] != self.lastdir: dirty.append(grid.player)
+        shown['player'] = grid.player
+        shown['lastdir'] = self.lastdir
+        return dirty
+    
+    def redraw(self, layer, i):
+        """
+        draw the area of cell i again: background from the static layer and
+        all sprites reaching into it (the cell and its neighbours, in the
+        same order as plot() does). returns the Rect drawn.
+        """
+        grid = self.soko.currentgrid
+        field = layer['field']
+        box = pygame.Rect(layer['pos'](i), layer['box']).clip(field)
+        self.screen.set_clip(box)
+        self.screen.blit(layer['base'], box, box.move(-field.x, -field.y))
+        rc, cc = divmod(i, grid.width)
+        for r in range(max(rc-1, 0), min(rc+2, grid.height)):
+            for c in range(max(cc-1, 0), min(cc+2, grid.width)):
+                col = grid.cells[r*grid.width + c]
+                if col: self.screen.blit(layer['sprites'][self.spritekey(col)], layer['pos'](r*grid.width + c))
+        self.screen.set_clip(None)
+        return box
+    
     def playfield(self, replay=False):
-        """draw playfield and statusbar during normal play"""
+        """
+        draw playfield and statusbar during normal play.
+        Only the cells changed since the last frame are drawn (on top of the
+        static layer of the level) and only those parts of the screen updated.
+        """
         # screen size
         sw = self.screen.get_width()
         sh = self.screen.get_height()
         sth = sh // self.STATUS # line height
         sh -= 2*sth # reserve space for status lines (top and bottom)
         
-        # draw entire screen
-        self.screen.fill(gfx.colors['bg1'])
-        
-        field = self.plot((sw,sh), (20,17), self.BORDER, floatzoom=False)
-        if field.get_width() > sw or field.get_height() > sh:
-            zf = min(sw / float(field.get_width()), sh / float(field.get_height()))
-            field = self.plot(dim=(max(field.get_width()*zf, sw), max(field.get_height()*zf, sh)), floatzoom=True)
-        
-        # Levelinfo
-        ox = 1
-        ox += self.text(self.soko.packinfo['title'], (1, 1), 'bg2')
-        ox += self.text(' [', (ox, 1),'b')
-        ox += self.text('%d' % self.soko.levelinfo['idx'], (ox, 1) ,'wall')
-        ox += self.text('/', (ox, 1),'b')
-        ox += self.text('%d' % (self.soko.packinfo['levels'] - 1), (ox, 1), 'wall')
-        ox += self.text('] ', (ox, 1),'b')
-        ox += self.text('%s' % self.soko.levelinfo['name'], (ox, 1), 'crat')
-        
-        self.screen.blit(field, (0, sth))
+        grid = self.soko.currentgrid
+        layer = self.layer(pygame.Rect(0, sth, sw, sh))
+        shown = self.shown
+        if shown is None or shown['layer'] is not layer or shown['replay'] != replay:
+            # draw entire screen
+            self.screen.fill(gfx.colors['bg1'])
+            self.screen.blit(layer['static'], layer['field'])
+            
+            # Levelinfo
+            ox = 1
+            ox += self.text(self.soko.packinfo['title'], (1, 1), 'bg2')
+            ox += self.text(' [', (ox, 1),'b')
+            ox += self.text('%d' % self.soko.levelinfo['idx'], (ox, 1) ,'wall')
+            ox += self.text('/', (ox, 1),'b')
+            ox += self.text('%d' % (self.soko.packinfo['levels'] - 1), (ox, 1), 'wall')
+            ox += self.text('] ', (ox, 1),'b')
+            ox += self.text('%s' % self.soko.levelinfo['name'], (ox, 1), 'crat')
+            
+            dirty = [i for i, col in enumerate(grid.cells) if col & (Grid.CRATE | Grid.SOKO)]
+            rects = None # all of it
+            shown = {'layer': layer, 'replay': replay, 'cells': bytearray(grid.cells),
+                     'player': grid.player, 'lastdir': self.lastdir}
+        else:
+            dirty = self.changed(shown, grid)
+            rects = []
+        for i in dirty:
+            box = self.redraw(layer, i)
+            if rects is not None: rects.append(box)
         
+        # status line at the bottom changes all the time
+        status = pygame.Rect(0, sh+sth, sw, self.screen.get_height() - sh - sth)
+        self.screen.fill(gfx.colors['bg1'], status)
         if not replay:
             ox = self.text('MOVES,PUSHES: ', (1, sh+sth), 'bg2')
             ox += self.text('%d,%d' % (len(self.soko.undo), self.soko.pushes), (ox, sh+sth), 'w')
@@ -217,7 +457,7 @@ class Pygameban:
             ox = self.text('REPLAY   ', (1, sh+sth), 'soko')
             ox += self.text('←→', (ox, sh+sth), 'w')
             ox += self.text(' Step [', (ox, sh+sth), 'bg2')
-            ox += self.text('%d,%d' % (self.soko.revframe, self.soko.getsolution()[self.soko.revframe][1]), (ox, sh+sth), 'crat')
+            ox += self.text('%d,%d' % (self.soko.revframe, self.soko.pushes), (ox, sh+sth), 'crat')
             ox += self.text('/', (ox, sh+sth), 'bg2')
             ox += self.text('%d,%d' % self.currsol, (ox, sh+sth), 'crat')
             ox += self.text(']   ', (ox, sh+sth), 'bg2')
@@ -229,6 +469,12 @@ class Pygameban:
             ox += self.text(' speed [', (ox, sh+sth), 'bg2')
             ox += self.text('%d' % (13 - self.replayspeed.bit_length()), (ox, sh+sth), 'crat')
             ox += self.text(']', (ox, sh+sth), 'bg2')
+        
+        self.shown = shown
+        if rects is None:
+            pygame.display.flip()
+        else:
+            pygame.display.update(rects + [status])
     
     def flipreplay(self, key=None):
         if key == pygame.K_F15:  self.soko.review(">")
@@ -237,6 +483,8 @@ class Pygameban:
         
         if key == pygame.K_HOME:self.soko.review("r")
         if key == pygame.K_END: self.soko.review("f")
+        if key == pygame.K_PAGEUP:   self.soko.review(self.soko.revframe - 50)
+        if key == pygame.K_PAGEDOWN: self.soko.review(self.soko.revframe + 50)
 
         if key == pygame.K_UP:   self.replayspeed //= 2
         if key == pygame.K_DOWN: self.replayspeed *= 2
@@ -262,7 +510,7 @@ class Pygameban:
         solved = "Found a new Solution!"
         
         if self.currsol is not None:
-            if self.currsol[0] <= len(self.soko.undo):
+            if self.currsol[0] <= len(self.soko.solutionmoves()):
                 solved = "Best solution so far: %d moves, %d pushes" % self.currsol
             else:
                 solved = "Found a better solution! (less than %d moves)" % self.currsol[0]
@@ -333,10 +581,7 @@ class Pygameban:
 
     def loadlevel(self, idx):
         self.soko.loadlevel(idx)
-        cs = self.soko.getsolution()
-        self.currsol = None
-        if cs is not None:
-            self.currsol = (len(cs)-1, cs[-1][1])
+        self.currsol = self.soko.getsummary()
         return 4
     
     def resume(self, dummy=None):
@@ -364,11 +609,13 @@ class Pygameban:
         ·   [←][↑][↓][→]  -  move sokoban
         ·   [R]           -  restart level
         ·   [U]           -  undo last move (unlimited)
+        ·   [Y]           -  redo undone move
         
         Keys in Replay:
         ·   [P]           -  play/pause
         ·   [↑][↓]        -  change speed
         ·   [←][→]        -  step
+        ·   [PgUp][PgDn]  -  jump 50 steps
         
         Always:
         ·   [Q] or [ESC]  -  return to (previous) menu or quit
@@ -382,52 +629,88 @@ class Pygameban:
         self.flipmenu()
         return 1
 
+    def setmenu(self, size, row, action):
+        """
+        make a menu with 'size' rows the current one. row(idx) returns row idx
+        as a pygame.Surface, action(idx) does what row idx is for and returns
+        the next state (see main). Rows are only drawn when they are shown and
+        a few of them are kept, so the number of rows doesn't matter.
+        """
+        self.menusize = size
+        self.menurow = row
+        self.menuaction = action
+        self.rows = LRU(self.ROWCACHE) # {idx: Surface}
+    
+    def menuitem(self, idx):
+        """row idx of the current menu (cached)"""
+        srf = self.rows.get(idx)
+        if srf is None:
+            srf = self.menurow(idx)
+            self.rows.put(idx, srf)
+        return srf
+    
+    def numberwidth(self, n):
+        """width (pixel) no number up to n is wider than"""
+        return len(str(n)) * max(g.get_width() for c, g in self.glyphatlas('w').items() if c.isdigit())
+    
+    def thumbnail(self, grid, dim, facing='^'):
+        """preview of 'grid' fitting into 'dim' (1:1 if possible)"""
+        size = self.geometry(grid, 2)[0]
+        if size[0] <= dim[0] and size[1] <= dim[1]:
+            return self.plot(minfield=(0,0), grid=grid, facing=facing)
+        zf = min(dim[0] / float(size[0]), dim[1] / float(size[1]))
+        # every level gets its own zoom, don't let them evict the playfield's sprites
+        return self.plot(dim=(size[0]*zf, size[1]*zf), minfield=(0,0), floatzoom=True, grid=grid, facing=facing, cache=False)
+    
+    def thumbkey(self, grid, dim):
+        """name of the preview of 'grid' in 'dim': hash of the level and the colors, size"""
+        h = hashlib.md5(("%d:%r:" % (grid.width, sorted(gfx.colors.items()))).encode("ascii"))
+        h.update(bytes(grid.cells))
+        return "%s-%dx%d" % (h.hexdigest(), dim[0], dim[1])
+    
     def mkmainmenu(self):
-        def mainitem(s):
+        def mainitem(idx):
             srf = pygame.Surface((self.screen.get_width(), self.screen.get_height() // self.STATUS), pygame.SRCALPHA)
-            self.text(s, (0,0), 'crat', srf)
+            self.text(items[idx][0], (0,0), 'crat', srf)
             return srf
-        # menulist is a list of tuples: (Surface, Function, Argument)
-        # Function(Argument) should return an int representing next state.
-        
-        self.menulist = [
-            (mainitem(' ►  Continue'         ), self.resume, None),
-            (mainitem(' ►  Choose Level'     ), lambda x: self.confirmleave()+1, None),
-            (mainitem(' ►  Play Random Level'), self.rndlvl, None),
-            (mainitem(' ►  Help'             ), self.gethelp, None),
-            (mainitem(' ►  Quit'             ), self.terminate, None)
+        # items are tuples: (Text, Function)
+        # Function(None) should return an int representing next state.
+        items = [
+            (' ►  Continue'         , self.resume),
+            (' ►  Choose Level'     , lambda x: self.confirmleave()+1),
+            (' ►  Play Random Level', self.rndlvl),
+            (' ►  Help'             , self.gethelp),
+            (' ►  Quit'             , self.terminate)
         ]
+        self.setmenu(len(items), mainitem, lambda idx: items[idx][1](None))
     
     def mkpackmenu(self):
-        # extend packs. first, get max horizontal width for each column
-        idxlen = max(self.font.size(str(p))[0] for p in range(len(self.soko.packs)))
-        levlen = max(self.font.size(str(len(p['levels'])))[0] for p in self.soko.packs)
-        self.menulist = []
-        for idx, pa in enumerate(self.soko.packs):
+        # width of the columns (without measuring every number)
+        idxlen = self.numberwidth(len(self.soko.packs) - 1)
+        levlen = self.numberwidth(self.maxlevels)
+        def packitem(idx):
             # {'file', 'title', 'levels'}
+            pa = self.soko.packs[idx]
             srf = pygame.Surface((self.screen.get_width(), self.screen.get_height() // self.STATUS), pygame.SRCALPHA)
             self.text(str(idx), (0,0), 'border', srf)
             self.text(pa['title'], (idxlen+self.STATUS,0), 'crat', srf)
             self.text(str(len(pa['levels'])), (self.screen.get_width()-(levlen), 0), 'w', srf)
-            self.menulist.append((srf, self.loadpack, idx))
+            return srf
+        self.setmenu(len(self.soko.packs), packitem, self.loadpack)
     
     def mklevelmenu(self):
-        self.menulist = []
-        idxlen = max(self.font.size(str(p))[0] for p in range(self.soko.packinfo['levels']))
-        
-        for idx, lvl in enumerate(self.soko.levellist()):
+        idxlen = self.numberwidth(self.soko.packinfo['levels'] - 1)
+        def levelitem(idx):
             srf = pygame.Surface((self.screen.get_width(), self.screen.get_height() // self.STATUS), pygame.SRCALPHA)
             self.text(str(idx), (0,0), 'border', srf)
-            ox = self.text(lvl[0], (idxlen+self.STATUS, 0), 'crat', srf)
-            cps = None
-            if self.soko.packinfo['file'] in self.soko.solutions:
-                if str(idx) in self.soko.solutions[self.soko.packinfo['file']]:
-                    cps = self.soko.solutions[self.soko.packinfo['file']][str(idx)][1]
+            ox = self.text(self.soko.levellist()[idx][0], (idxlen+self.STATUS, 0), 'crat', srf)
+            cps = self.soko.getsummary(idx)
             if cps:
-                self.text('%d moves' % len(cps), (idxlen+self.STATUS*2+ox, 0), 'soko', srf)
+                self.text('%d moves' % cps[0], (idxlen+self.STATUS*2+ox, 0), 'soko', srf)
             else:
                 self.text('unsolved', (idxlen+self.STATUS*2+ox, 0), 'border', srf)
-            self.menulist.append((srf, self.loadlevel, idx))
+            return srf
+        self.setmenu(self.soko.packinfo['levels'], levelitem, self.loadlevel)
     
     def flipmenu(self, key=None):
         if key == pygame.K_UP: self.menuselect -= 1
@@ -435,24 +718,23 @@ class Pygameban:
         if key == pygame.K_PAGEUP: self.menuselect -= 10
         if key == pygame.K_PAGEDOWN: self.menuselect += 10
         if key == pygame.K_HOME: self.menuselect = 0
-        if key == pygame.K_END: self.menuselect = len(self.menulist) - 1
+        if key == pygame.K_END: self.menuselect = self.menusize - 1
         if key == pygame.K_RETURN: 
-            fn = self.menulist[self.menuselect][1]
-            self.state = fn(self.menulist[self.menuselect][2])
+            self.state = self.menuaction(self.menuselect)
             # generate (unused) event to cycle main loop and redraw menu
             pygame.event.post(pygame.event.Event(pygame.USEREVENT + 3))
             return
         if key == pygame.K_s and self.state == 3:
-            if self.soko.getsolution(self.menuselect):
+            if self.soko.getsummary(self.menuselect):
                 self.loadlevel(self.menuselect)
                 self.replayauto = False
                 self.replayspeed = 512
                 self.state = 5
             return
-        if self.menuselect >= len(self.menulist):
+        if self.menuselect >= self.menusize:
             self.menuselect = 0
         if self.menuselect < 0:
-            self.menuselect = len(self.menulist)-1
+            self.menuselect = self.menusize-1
         
         # display
         sh = self.screen.get_height()
@@ -462,6 +744,7 @@ class Pygameban:
         
         # clear screen
         self.screen.fill(gfx.colors['bg1'])
+        self.shown = None
         # Obere Statuszeile
         tof = self.text('IKSOKOBAN 0.1  ', (0, 1), 'soko')
         if self.state == 1:
@@ -475,13 +758,13 @@ class Pygameban:
         if self.menuselect > self.STATUS//2 - 1:
             cursorpos = self.STATUS//2 - 1
         self.screen.fill(gfx.colors['wall'], (0, (2+cursorpos)*sth, sw, sth))
-        # texte
+        # texte (only the visible rows are drawn)
         start = self.menuselect - self.STATUS//2 + 1
         if start < 0: start = 0
         stop = start + self.STATUS - 2
-        if stop >= len(self.menulist): stop = len(self.menulist)
+        if stop >= self.menusize: stop = self.menusize
         
-        toblit = [x[0] for x in self.menulist[start:stop]]
+        toblit = [self.menuitem(i) for i in range(start, stop)]
         for i in range(len(toblit)):
             self.screen.blit(toblit[i], (0, (2+i)*sth))
         
@@ -514,43 +797,42 @@ class Pygameban:
             xof += self.text(self.soko.curtime, (xof, yof), 'soko')
             yof += sth*3//2
             playdim = (sw-20, sh+4*sth-yof)
-            # try 1:1 plot
-            playf = self.plot(minfield=(0,0))
-            if playf.get_width() > playdim[0] or playf.get_height() > playdim[1]:
-                # calculate new dimensions
-                zf = min(playdim[0] / float(playf.get_width()), playdim[1] / float(playf.get_height()))
-                playf = self.plot(dim=(playf.get_width()*zf, playf.get_height()*zf), minfield=(0,0), floatzoom=True)
+            playf = self.thumbnail(self.soko.currentgrid, playdim, self.lastdir)
             self.screen.blit(playf, (10,yof))
         
         # in level-select, diplay preview in lower right corner
         if self.state == 3:
-            # move current grid out of the way to generate preview
-            cgrid = self.soko.currentgrid
-            self.soko.currentgrid = self.soko.levellist()[self.menuselect][1]
-            # try 1:1 plot
+            # drawn in the background, the levels around the selected one as well
             playdim = (sw//2, sh//2)
-            playf = self.plot(minfield=(0,0))
-            if playf.get_width() > playdim[0] or playf.get_height() > playdim[1]:
-                # calculate new dimensions
-                zf = min(playdim[0] / float(playf.get_width()), playdim[1] / float(playf.get_height()))
-                playf = self.plot(dim=(playf.get_width()*zf, playf.get_height()*zf), minfield=(0,0), floatzoom=True)
-            self.screen.blit(playf, (sw-playf.get_width(),sth*1.75))
-            # restore current grid
-            self.soko.currentgrid = cgrid
+            levels = self.soko.levellist()
+            near = range(max(0, self.menuselect - self.PREFETCH), min(self.menusize, self.menuselect + self.PREFETCH + 1))
+            near = sorted(near, key=lambda i: abs(i - self.menuselect))
+            jobs = [(self.thumbkey(levels[i][1], playdim), levels[i][1], playdim) for i in near]
+            self.thumbs.want(jobs)
+            self.preview = jobs[0][0]
+            playf = self.thumbs.get(self.preview)
+            if playf is not None: # otherwise flipmenu() is called again when it's done
+                self.screen.blit(playf, (sw-playf.get_width(),sth*1.75))
     
     def main(self):
         trons = {
             pygame.K_UP:   '^', pygame.K_DOWN:  'v',
             pygame.K_LEFT: '<', pygame.K_RIGHT: '>',
-            pygame.K_r:    'r', pygame.K_u:     'u'
+            pygame.K_r:    'r', pygame.K_u:     'u',
+            pygame.K_y:    'y'
         }
-        
+        # window uncovered or restored (pygame 1 only knows VIDEOEXPOSE)
+        expose = tuple(getattr(pygame, e) for e in ("VIDEOEXPOSE", "WINDOWEXPOSED", "WINDOWRESTORED") if hasattr(pygame, e))
+
         self.state = 1 # 1=main menu 2=packselect 3=levelselect 4=play
         self.menuselect = 0
         self.lastdir = '↑' # orientation of player
         # timer-events & repeated keypress
         pygame.PLAYSECOND = pygame.USEREVENT + 1
         pygame.REPLAY = pygame.USEREVENT + 2
+        pygame.THUMBNAIL = pygame.USEREVENT + 4 # a level preview is ready
+        self.thumbs = Thumbnails(self.thumbnail, self.THUMBCACHE, self.THUMBDIR, pygame.THUMBNAIL, self.THUMBFILES)
+        self.preview = None # key of the preview shown in level-select
         self.mkmainmenu()
         self.flipmenu()
         pygame.display.flip()
@@ -585,6 +867,9 @@ class Pygameban:
             if ev.type == pygame.REPLAY and self.state == 5:
                 self.flipreplay(pygame.K_F15)
 
+            if ev.type == pygame.THUMBNAIL and self.state == 3 and ev.key == self.preview:
+                self.flipmenu()
+
             if ev.type == pygame.PLAYSECOND:
                 self.soko.updatetime()
                 self.playfield()
@@ -593,6 +878,11 @@ class Pygameban:
                 self.resize(ev.w, ev.h)
                 # invalidate oldstate to force rerendering
                 oldstate = -1
+
+            if ev.type in expose:
+                # window contents got lost, playfield() has to draw everything again
+                self.shown = None
+                if self.state in (4, 5): self.playfield(self.state == 5)
             
             if ev.type == pygame.QUIT:
                 self.state = 0
@@ -636,7 +926,8 @@ class Pygameban:
                 if self.state == 5:
                     self.flipreplay(ev.key)
             
-            pygame.display.flip()
+            # playfield() updates the parts of the screen it has drawn itself
+            if self.state < 4: pygame.display.flip()
         self.terminate()
 
 
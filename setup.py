@@ -25,5 +25,5 @@ setup(
   windows = [{"script":"pygameban.py"}],
   console = [{"script":"ansiban.py"}],
   options=opts,
-  data_files = [("", ["levels.zip"])],
+  data_files = [("", ["levels.zip"] + (["levels.arc"] if os.path.exists("levels.arc") else []))],
 )
@@ -1,7 +1,26 @@
 #!/usr/bin/env python
 
 # this ist fully python 2 & 3 compatible now.
-import re, os, sys, time, json, gzip, zipfile, converda
+import re, os, sys, time, json, gzip, random, zipfile, hashlib, collections, converda, levelarc, solstore
+
+def checklevel(cells, width, height):
+    """
+    check level for validity
+    (1 Player, same number of crates & targets (et least 1), not solved)
+    'cells' may be any iterable of fieldvalues, it is only walked once.
+    returns a Counter {fieldvalue: number}
+    """
+    cnt = collections.Counter(cells)
+    SOKO, CRATE, TARGET = Grid.SOKO, Grid.CRATE, Grid.TARGET
+    player = cnt[SOKO] + cnt[SOKO | TARGET]
+    crates = cnt[CRATE]
+    target = cnt[TARGET] + cnt[SOKO | TARGET]
+    cratar = cnt[CRATE | TARGET]
+    assert width * height > 2, "Level too small (%d x %d)" % (width, height)
+    assert player == 1, "Level invalid: %d players" % player
+    assert crates == target, "Level invalid: %d crates, %d targets" % (crates, target)
+    assert crates + cratar > 0, "Level invalid: no crates at all"
+    return cnt
 
 class Grid:
     # [
@@ -22,15 +41,7 @@ class Grid:
                 grid[r] += [0] * (self.width - len(grid[r]))
 
         # check level for validity
-        # (1 Player, same number of crates & targets (et least 1), not solved)
-        player = self.count(self.SOKO) + self.count(self.SOKO | self.TARGET)
-        crates = self.count(self.CRATE)
-        target = self.count(self.TARGET) + self.count(self.SOKO | self.TARGET)
-        cratar = self.count(self.CRATE | self.TARGET)
-        assert self.width * self.height > 2, "Level too small (%d x %d)" % (self.width, self.height)
-        assert player == 1, "Level invalid: %d players" % player
-        assert crates == target, "Level invalid: %d crates, %d targets" % (crates, target)
-        assert crates + cratar > 0, "Level invalid: no crates at all"
+        checklevel((col for row in grid for col in row), self.width, self.height)
     
     def copy(self): return [[x for x in y] for y in self.grid]
     
@@ -104,10 +115,458 @@ class Grid:
         self.grid[player[0]][player[1]] -= self.SOKO
         return pushed
     
+    def rows(self): return self.copy()
+
     def __str__(self):
         return "\n".join(" ".join("%X" % y for y in x) for x in self.grid)
 
 
+class FlatGrid(object):
+    """
+    Same API as Grid, but all cells are kept in one flat bytearray (row by row)
+    and the position of the player is tracked, so move() doesn't have to
+    search the whole board every time.
+    Can be initialized with nested lists (like Grid), with flat cells and
+    their width or with another FlatGrid (cheap copy, no validation).
+    The number of crates not on a target is kept up to date in move(), so
+    iswin() doesn't have to look at the board at all.
+    Same for deadlocks: the number of deadly 2x2-windows and crates on dead
+    squares (see deadsquares()) is counted once on the first isdead() and
+    after that only the cells around a pushed crate are checked again.
+    And for the Zobrist hash of the crates, see key().
+    """
+    TARGET = Grid.TARGET
+    CRATE  = Grid.CRATE
+    WALL   = Grid.WALL
+    SOKO   = Grid.SOKO
+    OFFSET = {"^": (-1,0), "v": (1,0), "<": (0,-1), ">": (0,1)}
+    STATIC = bytes(bytearray(i & (Grid.WALL | Grid.TARGET) for i in range(256))) # translation table
+    __slots__ = ('width', 'height', 'cells', 'player', 'todo', 'dead', 'deadmap', 'keys', 'zobrist', 'region')
+
+    def __init__(self, grid, width=None):
+        if isinstance(grid, FlatGrid):
+            self.width = grid.width
+            self.height = grid.height
+            self.cells = bytearray(grid.cells)
+            self.player = grid.player
+            self.todo = grid.todo
+            self.dead = grid.dead
+            self.deadmap = grid.deadmap
+            self.keys = grid.keys
+            self.zobrist = grid.zobrist
+            self.region = grid.region
+            return
+        if isinstance(grid, Grid): grid = grid.grid
+        if width is not None:
+            self.width = width
+            self.height = len(grid) // width
+            self.cells = bytearray(grid)
+        else:
+            self.height = len(grid)
+            self.width = max(len(row) for row in grid)
+            self.cells = bytearray()
+            for row in grid:
+                self.cells.extend(row)
+                self.cells.extend(bytearray(self.width - len(row)))
+
+        cnt = checklevel(self.cells, self.width, self.height)
+        self.todo = cnt[self.CRATE]
+        self.dead = None # number of deadlocks, None = not counted yet
+        self.deadmap = None # see deadsquares()
+        self.player = self.cells.find(bytearray((self.SOKO,)))
+        if self.player < 0: self.player = self.cells.find(bytearray((self.SOKO | self.TARGET,)))
+        self.keys = zobristkeys(len(self.cells))
+        self.zobrist = 0 # of crates only
+        for i, c in enumerate(self.cells):
+            if c & self.CRATE: self.zobrist ^= self.keys[0][i]
+        self.region = None # normalized player cell, None = not known yet
+
+    def copy(self): return FlatGrid(self)
+
+    def rows(self):
+        """return cells as nested lists (like Grid.copy())"""
+        w = self.width
+        return [list(self.cells[i:i+w]) for i in range(0, len(self.cells), w)]
+
+    def count(self, what): return self.cells.count(bytearray((what,)))
+
+    def iswin(self): return self.todo == 0
+
+    def isdead(self):
+        """
+        same checks as Grid.isdead(), additionally a crate (not on a target)
+        on a dead square is a deadlock as well.
+        """
+        if self.dead is None:
+            w = self.width
+            self.deadmap = deadsquares(self)
+            self.dead = sum(self.quaddead(i) for r in range(self.height - 1) for i in range(r * w, r * w + w - 1))
+            self.dead += sum(1 for i, c in enumerate(self.cells) if c == self.CRATE and self.deadmap[i])
+        return self.dead > 0
+
+    def quaddead(self, i):
+        """is the 2x2-window with upper left cell i a deadlock? (see Grid.isdead())"""
+        w = self.width
+        cells = self.cells
+        quad = (cells[i], cells[i+1], cells[i+w], cells[i+w+1])
+        if self.CRATE not in quad: return False
+        if all(1 < q < 8 for q in quad): return True
+        if quad[0] == self.CRATE and quad[1] == self.WALL and quad[2] == self.WALL: return True
+        if quad[1] == self.CRATE and quad[0] == self.WALL and quad[3] == self.WALL: return True
+        if quad[2] == self.CRATE and quad[0] == self.WALL and quad[3] == self.WALL: return True
+        if quad[3] == self.CRATE and quad[1] == self.WALL and quad[2] == self.WALL: return True
+        return False
+
+    def windows(self, *idx):
+        """upper left cells of all 2x2-windows containing any of the cells 'idx'"""
+        w = self.width
+        quads = set()
+        for i in idx:
+            row, col = divmod(i, w)
+            for r in (row - 1, row):
+                if not 0 <= r < self.height - 1: continue
+                for c in (col - 1, col):
+                    if 0 <= c < w - 1: quads.add(r * w + c)
+        return quads
+
+    def findplayer(self): return divmod(self.player, self.width)
+
+    def reachable(self):
+        """
+        cells the player can walk to without pushing anything.
+        returns (bytearray with 1 for each reachable cell, normalized player
+        cell: the top-left-most of them)
+        """
+        w, h = self.width, self.height
+        cells = self.cells
+        seen = bytearray(len(cells))
+        seen[self.player] = 1
+        todo = [self.player]
+        for i in todo:
+            row, col = divmod(i, w)
+            for dr, dc in self.OFFSET.values():
+                if not (0 <= row + dr < h and 0 <= col + dc < w): continue
+                j = i + dr * w + dc
+                if not seen[j] and not cells[j] & (self.WALL | self.CRATE):
+                    seen[j] = 1
+                    todo.append(j)
+        self.region = min(todo)
+        return seen, self.region
+
+    def key(self, exact=False):
+        """
+        Zobrist hash of the position: crates and the area the player can reach
+        (or, if exact, the cell he is on). Positions with the same key are the
+        same for anything but walking. Walking around doesn't change the area,
+        so only the first key() after a push has to look at the board.
+        """
+        if exact: return self.zobrist ^ self.keys[1][self.player]
+        if self.region is None: self.reachable()
+        return self.zobrist ^ self.keys[1][self.region]
+
+    def statichash(self):
+        """hash of walls and targets only. It doesn't change while playing."""
+        static = bytes(self.cells).translate(self.STATIC)
+        return hashlib.md5(("%d:" % self.width).encode("ascii") + static).hexdigest()
+
+    def move(self, d):
+        """Move Player in given direction."""
+        dr, dc = self.OFFSET[d]
+        row, col = divmod(self.player, self.width)
+        # boundary check for soko
+        if not (0 <= row + dr < self.height and 0 <= col + dc < self.width):
+            return None
+        off = dr * self.width + dc
+        tf = self.player + off
+        cells = self.cells
+        pushed = 0
+        # check collision
+        if cells[tf] & self.WALL: return None
+        if cells[tf] & self.CRATE:
+            # boundary-check for box
+            if not (0 <= row + 2*dr < self.height and 0 <= col + 2*dc < self.width):
+                return None
+            bf = tf + off
+            if cells[bf] & (self.WALL | self.CRATE):
+                return None
+            # fine, move box
+            pushed = 1
+            self.movecrate(tf, bf)
+        # move soko
+        cells[tf] += self.SOKO
+        cells[self.player] -= self.SOKO
+        self.player = tf
+        return pushed
+
+    def unmove(self, d, pushed):
+        """Take back move(d) which returned 'pushed' (pull the crate back)."""
+        dr, dc = self.OFFSET[d]
+        off = dr * self.width + dc
+        tf = self.player
+        cells = self.cells
+        cells[tf - off] += self.SOKO
+        cells[tf] -= self.SOKO
+        self.player = tf - off
+        if pushed: self.movecrate(tf + off, tf)
+
+    def movecrate(self, src, dst):
+        """Move crate from cell src to (free) cell dst, update counters."""
+        cells = self.cells
+        # only windows around the crate may change their deadlock-state
+        if self.dead is not None:
+            quads = self.windows(src, dst)
+            self.dead -= sum(self.quaddead(q) for q in quads)
+        cells[dst] += self.CRATE
+        cells[src] -= self.CRATE
+        self.zobrist ^= self.keys[0][src] ^ self.keys[0][dst]
+        self.region = None
+        # crate left or reached a target?
+        self.todo += (cells[src] & self.TARGET) - (cells[dst] & self.TARGET)
+        if self.dead is not None:
+            self.dead += sum(self.quaddead(q) for q in quads)
+            self.dead += self.deadmap[dst] - self.deadmap[src]
+
+    def __str__(self):
+        return "\n".join(" ".join("%X" % y for y in x) for x in self.rows())
+
+
+ZOBRIST = {} # {number of cells: (keys for crates, keys for the player)}
+
+def zobristkeys(cells):
+    """random keys for each of 'cells' cells, the same in every run and process"""
+    if cells not in ZOBRIST:
+        rnd = random.Random(cells)
+        ZOBRIST[cells] = ([rnd.getrandbits(64) for i in range(cells)], [rnd.getrandbits(64) for i in range(cells)])
+    return ZOBRIST[cells]
+
+DEADSQUARES = {} # {FlatGrid.statichash(): deadsquares, }
+
+def deadsquares(grid):
+    """
+    Find all cells of a FlatGrid from which a crate can never reach any target
+    (no matter where the other crates are). Do it backwards: start with a crate
+    on each target and pull it in every possible direction. Every free cell not
+    reached this way is a dead square.
+    Only depends on walls and targets, so it's cached per level.
+    returns a bytearray with 1 for each dead square
+    """
+    key = grid.statichash()
+    if key in DEADSQUARES: return DEADSQUARES[key]
+    w, h = grid.width, grid.height
+    free = [not c & grid.WALL for c in grid.cells]
+    live = bytearray(len(free))
+    todo = [i for i, c in enumerate(grid.cells) if c & grid.TARGET]
+    for i in todo: live[i] = 1
+    while todo:
+        i = todo.pop()
+        row, col = divmod(i, w)
+        for dr, dc in grid.OFFSET.values():
+            # crate moves to i+d, player has to stand at i+d and walks to i+2d
+            if not (0 <= row + 2*dr < h and 0 <= col + 2*dc < w): continue
+            j = i + dr * w + dc
+            if not live[j] and free[j] and free[j + dr * w + dc]:
+                live[j] = 1
+                todo.append(j)
+    dead = bytearray(f and not l for f, l in zip(free, live))
+    DEADSQUARES[key] = dead
+    return dead
+
+
+def stripcircles(grid, moves):
+    """
+    moves (string) without circles: whenever the player gets back to a
+    position he has been in before (same crates, same cell, see
+    FlatGrid.key()), the moves in between are left out.
+    'grid' is the startframe (FlatGrid), it isn't changed.
+    """
+    grid = grid.copy()
+    path = [grid.key(True)] # key of each position on the way so far
+    seen = {path[0]: 0} # {key: index in path}
+    out = []
+    for d in moves:
+        if grid.move(d) is None: continue
+        key = grid.key(True)
+        if key in seen: # walked in a circle, forget it
+            for k in path[seen[key] + 1:]: del seen[k]
+            del path[seen[key] + 1:]
+            del out[seen[key]:]
+        else:
+            out.append(d)
+            seen[key] = len(path)
+            path.append(key)
+    return "".join(out)
+
+
+class Replay(object):
+    """
+    Random access to all frames of a solution (startframe, moves) without
+    expanding it: every KEYFRAME moves a copy of the grid is kept, any other
+    frame is reached by playing on from the nearest keyframe (or from the
+    current frame if that is closer, backwards as well).
+    replay[i] is (FlatGrid, pushes) of frame i. Frame 0 is the startframe,
+    len(replay) == number of moves + 1.
+    The returned FlatGrid is the cursor itself, copy it before playing on it.
+    """
+    KEYFRAME = 64
+
+    def __init__(self, solution):
+        self.moves = solution[1]
+        self.grid = FlatGrid(solution[0])
+        self.pushed = bytearray(len(self.moves)) # push flag per move
+        self.keys = [] # [(FlatGrid, pushes), ...] for every KEYFRAME-th frame
+        self.pushes = 0 # total
+        for i, d in enumerate(self.moves):
+            if i % self.KEYFRAME == 0: self.keys.append((self.grid.copy(), self.pushes))
+            pushed = self.grid.move(d)
+            assert pushed is not None, "Invalid move %d (%s)" % (i, d)
+            self.pushed[i] = pushed
+            self.pushes += pushed
+        # cursor is on the last frame now
+        self.frame = len(self.moves)
+        self.framepushes = self.pushes
+
+    def __len__(self): return len(self.moves) + 1
+
+    def __getitem__(self, frame):
+        if frame < 0: frame += len(self)
+        if not 0 <= frame < len(self): raise IndexError("No frame %d" % frame)
+        self.seek(frame)
+        return self.grid, self.framepushes
+
+    def seek(self, frame):
+        key = min(frame // self.KEYFRAME, len(self.keys) - 1) # last frame may be past the last keyframe
+        if frame - key * self.KEYFRAME < abs(frame - self.frame):
+            self.grid = self.keys[key][0].copy()
+            self.framepushes = self.keys[key][1]
+            self.frame = key * self.KEYFRAME
+        while self.frame < frame:
+            self.framepushes += self.grid.move(self.moves[self.frame])
+            self.frame += 1
+        while self.frame > frame:
+            self.frame -= 1
+            self.grid.unmove(self.moves[self.frame], self.pushed[self.frame])
+            self.framepushes -= self.pushed[self.frame]
+
+
+class LRU(object):
+    """
+    Small least-recently-used cache. Keeps at most 'maxsize' entries or, if
+    'sizeof' is given, entries whose sizeof(value) sum up to 'maxsize'.
+    The last entry put in is never dropped. Counts hits, misses and evictions.
+    """
+    def __init__(self, maxsize, sizeof=None):
+        self.maxsize = maxsize
+        self.sizeof = sizeof or (lambda value: 1)
+        self.data = collections.OrderedDict()
+        self.size = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def __len__(self): return len(self.data)
+
+    def __contains__(self, key): return key in self.data
+
+    def get(self, key, default=None):
+        try:
+            value = self.data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self.data[key] = value # most recently used is last
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if key in self.data: self.size -= self.sizeof(self.data.pop(key))
+        self.data[key] = value
+        self.size += self.sizeof(value)
+        while self.size > self.maxsize and len(self.data) > 1:
+            self.size -= self.sizeof(self.data.popitem(last=False)[1])
+            self.evictions += 1
+
+    def clear(self):
+        self.data.clear()
+        self.size = 0
+
+    def stats(self):
+        return {'entries': len(self.data), 'size': self.size,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+def readpack(levelzip, filename, verbose=True):
+    """
+    Read textfile with levelset (packfile) from an open ZipFile.
+    return {
+        'file' : filename,
+        'title' : title,
+        'levels' : levels, # list of tuples [(title, grid), ...]
+        'offsets' : offsets # bytes-offset of each levels title row
+    }
+    Errors in levels are written to stderr if verbose.
+    """
+    def warn(s):
+        if verbose: sys.stderr.write(s)
+    # read default sokoban-format 0.08
+    levelfile = levelzip.open(filename)
+    # 1. Row starts with semicolon: Title of Levelpack
+    title = levelfile.readline()
+    offset = len(title) # of current row
+    title = title.decode("utf-8").strip()
+    assert len(title) > 0 and title[0] == ";", "File does not start with ;"
+    name = re.compile("^;+\\s*(.*)")
+    title = name.search(title).group(1)
+    levels = []
+    offsets = []
+    currentlevel = []
+    levelname = ""
+    leveloffset = 0
+    rowcount = 1
+    for line in levelfile:
+        lineoffset = offset
+        offset += len(line)
+        line = line.decode("utf-8", "ignore")
+        rowcount += 1
+        # Leere Zeilen ignorieren
+        if len(line.strip()) == 0: continue
+        if line.startswith(";"):
+            if levelname and currentlevel:
+                try:
+                    newg = FlatGrid(currentlevel)
+                    assert not newg.iswin(), "All crates on their targets. Nothing to do."
+                    levels.append((levelname, newg))
+                    offsets.append(leveloffset)
+                except AssertionError as e:
+                    warn("[%s : %d] '%s': %s\n" % (filename, rowcount, levelname, str(e)))
+                
+            levelname = name.search(line).group(1).strip()
+            leveloffset = lineoffset
+            currentlevel = []
+        else:
+            if levelname:
+                try:
+                    currentlevel.append([Sokoban.DECODE[x] for x in line.rstrip()])
+                except KeyError as e:
+                    warn("[%s : %d] Error decoding %s\n" % (filename, rowcount, str(e)))
+                    levelname = ""
+                    currentlevel = []
+            else:
+                warn("[%s : %d] Warning: Reading (ignoring) level without name\n" % (filename, rowcount))
+    # den letzten nicht vergessen
+    if levelname and currentlevel:
+        try:
+            levels.append((levelname, FlatGrid(currentlevel)))
+            offsets.append(leveloffset)
+        except AssertionError as e:
+            warn("[%s : %d] '%s': %s\n" % (filename, rowcount, levelname, str(e)))
+    levelfile.close()
+    
+    return {
+        'file' : filename,
+        'title' : title,
+        'levels' : levels, # list of tuples [(title, FlatGrid), ...]
+        'offsets' : offsets
+    }
+
+
 class Sokoban:
     """
     Load/manage levelpacks, solutions and resume. Play or review a single level.
@@ -128,42 +587,46 @@ class Sokoban:
     prf = os.path.expanduser("~")
     if sys.platform == "win32": prf = PREFIX
     SAVEFILE = os.path.join(prf,"sokoban.current.jgz")
-    SOLFILE = os.path.join(prf,"sokoban.solutions.hgz")
+    SOLFILE = os.path.join(prf,"sokoban.solutions.hgz") # old format, imported once into SOLDIR
+    SOLDIR = os.path.join(prf,"sokoban.solutions")
+    INDEXFILE = os.path.join(prf,"sokoban.index.jgz")
+    PACKCACHE = 8 << 20 # keep parsed packs up to this many (estimated) bytes
     
     def __init__(self, levelzip):
         # levels are stored in a zipfile. Be careful to get it zipped up in order.
         self.levelzip = zipfile.ZipFile(os.path.join(self.PREFIX, levelzip))
-        # {'file': str, 'title': str, 'levels': [(str, Grid), ...]}
-        self.packs = [self.fileinfo(fi) for fi in self.levelzip.infolist() if fi.filename.endswith(".txt")]
+        # {'file': str, 'title': str, 'crc': int, 'levels': [(str, offset), ...]}
+        # or (compiled archive) {'file': str, 'title': str, 'levels': levelarc.Pack}
+        self.archive = self.openarchive()
+        if self.archive:
+            self.packs = self.archive.packs()
+        else:
+            self.packs = self.indexpacks(levelzip)
+        # parsed packs {idx: [(str, FlatGrid), ...]}
+        self.packcache = LRU(self.PACKCACHE, lambda levels: sum(len(g.cells) + 400 for n, g in levels))
         # cummulated number of available levels
         self.cumlevels = sum(len(x['levels']) for x in self.packs)
         
         self.packinfo = None # {'idx': int, 'file': str, 'title': str, 'levels': int}
         self.levelinfo = None # {'idx': int, 'name': str}
-        self.currentgrid = None # Instance of Grid
+        self.currentgrid = None # Instance of FlatGrid
         self.starttime = None # Level started (first movement) (seconds since epoch)
         self.curtime = "--:--:--" # human readable playtime for current level
         self.pushes = 0 # number of pushes in this level. Number of moves == len(undo)
-        self.undo = [] # store a stack of previous grid-arrays and number of pushes
+        self.undo = [] # stack of moves [(direction, pushed), ...]
+        self.redo = [] # stack of undone directions
         
         # load last state (if any)
         try:
             self.loadgame()
         except Exception as e:
-            sys.stdout.write("Cannot load last game: %s\n" % e)
+            sys.stderr.write("Cannot load last game: %s\n" % e)
         
-        # load solutions
-        self.solutions = {} # dict {filename: {levelindex: undo[], }, }
+        # solutions are loaded per pack when needed
+        self.solutions = solstore.SolutionStore(self.SOLDIR, self.SOLFILE)
         self.revidx = None # current review indizes
         self.revstack = None
         self.revframe = 0 # current review-frame
-        try:
-            fo = gzip.open(self.SOLFILE, 'r')
-            self.solutions = json.load(fo)
-            fo.close()
-        except:
-            # maybe not played yet.
-            pass
     
     def canonicpath(self, pth):
         """
@@ -178,79 +641,70 @@ class Sokoban:
         """
         return os.path.join(self.PREFIX, *pth.split("/"))
     
-    def readfile(self, filename):
+    def readfile(self, filename, verbose=True):
+        """Read packfile from levelzip, see readpack()"""
+        return readpack(self.levelzip, filename, verbose)
+
+    def indexpacks(self, levelzip):
         """
-        Read textfile with levelset (packfile).
-        return {
-            'file' : filename,
-            'title' : title,
-            'levels' : levels # list of tuples [(title, grid), ...]
-        }
+        Title, level names and offsets of all packs in levelzip without
+        reading all of them on every start: this is cached in INDEXFILE.
+        If size or mtime of the zip changed, only members with a different
+        CRC are read again.
+        returns [{'file': str, 'title': str, 'crc': int, 'levels': [(str, offset), ...]}, ...]
         """
-        # read default sokoban-format 0.08
-        levelfile = self.levelzip.open(filename)
-        # 1. Row starts with semicolon: Title of Levelpack
-        title = levelfile.readline().decode("utf-8").strip()
-        assert len(title) > 0 and title[0] == ";", "File does not start with ;"
-        name = re.compile("^;+\\s*(.*)")
-        title = name.search(title).group(1)
-        levels = []
-        currentlevel = []
-        levelname = ""
-        rowcount = 1
-        for line in levelfile:
-            line = line.decode("utf-8", "ignore")
-            rowcount += 1
-            # Leere Zeilen ignorieren
-            if len(line.strip()) == 0: continue
-            if line.startswith(";"):
-                if levelname and currentlevel:
-                    try:
-                        newg = Grid(currentlevel)
-                        assert not newg.iswin(), "All crates on their targets. Nothing to do."
-                        levels.append((levelname, newg))
-                    except AssertionError as e:
-                        sys.stderr.write("[%s : %d] '%s': %s\n" % (filename, rowcount, levelname, str(e)))
-                    
-                levelname = name.search(line).group(1).strip()
-                currentlevel = []
-            else:
-                if levelname:
-                    try:
-                        currentlevel.append([self.DECODE[x] for x in line.rstrip()])
-                    except KeyError as e:
-                        sys.stderr.write("[%s : %d] Error decoding %s\n" % (filename, rowcount, str(e)))
-                        levelname = ""
-                        currentlevel = []
-                else:
-                    sys.stderr.write("[%s : %d] Warning: Reading (ignoring) level without name\n" % (filename, rowcount))
-        # den letzten nicht vergessen
-        if levelname and currentlevel:
-            try:
-                levels.append((levelname, Grid(currentlevel)))
-            except AssertionError as e:
-                sys.stderr.write("[%s : %d] '%s': %s\n" % (filename, rowcount, levelname, str(e)))
-        levelfile.close()
+        st = os.stat(self.levelzip.filename)
+        try:
+            fo = gzip.open(self.INDEXFILE, 'rb')
+            index = json.load(fo)
+            fo.close()
+        except:
+            index = {} # no index yet
+        zidx = index.get(levelzip)
+        if zidx and zidx['size'] == st.st_size and zidx['mtime'] == st.st_mtime:
+            return zidx['packs']
         
-        return {
-            'file' : filename,
-            'title' : title,
-            'levels' : levels # list of tuples [(title, grid), ...]
-        }
-
-    def fileinfo(self, finfo):
-        """read levelset, only return packtitle and number of levels"""
-        fileobj = self.levelzip.open(finfo)
-        title = fileobj.readline().decode("utf-8")
-        assert len(title) > 0 and title.startswith(";"), "File does not start with ;"
-        title = re.search("^;+\\s*(.*)", title).group(1)
-        nums = sum(x.strip().startswith(b";") for x in fileobj)
-        fileobj.close()
-        return {'file': finfo.filename, 'title': title, 'levels': 'x'*nums}
+        known = dict((p['file'], p) for p in zidx['packs']) if zidx else {}
+        packs = []
+        for fi in self.levelzip.infolist():
+            if not fi.filename.endswith(".txt"): continue
+            pack = known.get(fi.filename)
+            if pack is None or pack['crc'] != fi.CRC:
+                pug = self.readfile(fi.filename, verbose=False)
+                pack = {
+                    'file'  : fi.filename, 'title' : pug['title'], 'crc': fi.CRC, 
+                    'levels': [(lvl[0], off) for lvl, off in zip(pug['levels'], pug['offsets'])]
+                }
+            packs.append(pack)
+        index[levelzip] = {'size': st.st_size, 'mtime': st.st_mtime, 'packs': packs}
+        try:
+            fo = gzip.open(self.INDEXFILE, 'wb')
+            fo.write(json.dumps(index).encode("ascii"))
+            fo.close()
+        except Exception as e:
+            sys.stderr.write("Cannot save level index: %s\n" % e)
+        return packs
         
+    def openarchive(self):
+        """
+        Open compiled levelarchive (see levelarc.py) next to the levelzip
+        (levels.zip -> levels.arc) if there is an up to date one.
+        """
+        arc = os.path.splitext(self.levelzip.filename)[0] + ".arc"
+        if not os.path.exists(arc): return None
+        try:
+            archive = levelarc.Archive(arc)
+        except Exception as e:
+            sys.stderr.write("Cannot open level archive: %s\n" % e)
+            return None
+        if not archive.matches(self.levelzip):
+            sys.stderr.write("Level archive %s is outdated, ignoring it\n" % arc)
+            archive.close()
+            return None
+        return archive
+    
     def loadpack(self, idx):
-        pug = self.readfile(self.packs[idx]['file'])
-        self.packs[idx] = pug
+        pug = self.packs[idx]
         self.packinfo = {
             'idx'  : idx,          'file'  : pug['file'], 
             'title': pug['title'], 'levels': len(pug['levels'])
@@ -259,16 +713,29 @@ class Sokoban:
         
     def levellist(self): 
         assert self.packinfo is not None, "No current levelpack"
-        return self.packs[self.packinfo['idx']]['levels']
+        return self.packlevels(self.packinfo['idx'])
+    
+    def packlevels(self, idx):
+        """
+        levels of pack idx [(str, FlatGrid), ...]. Parsed packs are kept in
+        packcache (and parsed again if they were dropped from there).
+        """
+        if self.archive: return self.packs[idx]['levels']
+        levels = self.packcache.get(idx)
+        if levels is None:
+            levels = self.readfile(self.packs[idx]['file'])['levels']
+            self.packcache.put(idx, levels)
+        return levels
     
     def loadlevel(self, idx):
         lvl = self.levellist()[idx]
         self.levelinfo = {'idx': idx, 'name': lvl[0]}
-        self.currentgrid = Grid(lvl[1].copy())
+        self.currentgrid = lvl[1].copy()
         self.starttime = None
         self.curtime = "--:--:--"
         self.pushes = 0
         self.undo = []
+        self.redo = []
         self.revframe = 0
         
     def updatetime(self):
@@ -283,31 +750,44 @@ class Sokoban:
         return true if solved, false otherwise.
         < v ^ > move
         u undo
+        y redo
         r restart
         
         """
         assert self.levelinfo is not None, "No current level"
         if action == "r": self.loadlevel(self.levelinfo['idx'])
+        if action == "y" and self.redo: action = self.redo[-1]
         if action in ("<","^", "v", ">"): 
             if not self.starttime: self.starttime = time.time()
             self.updatetime()
-            self.undo.append((self.currentgrid.copy(), self.pushes))
             moved = self.currentgrid.move(action)
-            if moved is not None:
+            if moved is not None: # do not keep non-movements
+                self.undo.append((action, moved))
                 self.pushes += moved
+                # walking along the undone path keeps the rest of it
+                if self.redo and self.redo[-1] == action: self.redo.pop()
+                else: self.redo = []
                 if self.currentgrid.iswin():
                     # self.setsolution()  # call this in frontend (may take a while)
                     return True
-            else:
-                self.undo.pop() # do not keep non-movements
         if action == "u": 
             if len(self.undo) > 0:
-                laststep = self.undo.pop()
-                self.currentgrid = Grid(laststep[0])
-                self.pushes = laststep[1]
+                d, pushed = self.undo.pop()
+                self.currentgrid.unmove(d, pushed)
+                self.pushes -= pushed
+                self.redo.append(d)
             else:
                 self.loadlevel(self.levelinfo['idx'])
         return False
+
+    def moves(self):
+        """all moves from start to current position as string"""
+        return "".join(d for d, pushed in self.undo)
+
+    def solutionmoves(self):
+        """moves (string) as setsolution() would store them: without circles"""
+        assert self.levelinfo is not None, "No current level"
+        return stripcircles(self.levellist()[self.levelinfo['idx']][1], self.moves())
     
     def review(self, action="r"):
         """
@@ -318,7 +798,8 @@ class Sokoban:
         < > previous/next frame
         r restart (goto first frame)
         f finish (goto last frame)
-        returns current frame (Grid, pushes)
+        int goto this frame
+        sets currentgrid and pushes to current frame
         """
         cs = self.getsolution()
         assert cs is not None, "No solution for this level yet."
@@ -326,9 +807,10 @@ class Sokoban:
         if action == "f": self.revframe = len(cs) - 1
         if action == "<": self.revframe = max(0, self.revframe - 1)
         if action == ">": self.revframe = min(len(cs) - 1, self.revframe + 1)
+        if isinstance(action, int): self.revframe = max(0, min(len(cs) - 1, action))
         
-        self.currentgrid = Grid(cs[self.revframe][0])
-        self.pushes = cs[self.revframe][1]
+        grid, self.pushes = cs[self.revframe]
+        self.currentgrid = grid.copy()
     
     def savegame(self):
         if self.levelinfo is None:
@@ -337,7 +819,8 @@ class Sokoban:
             'packfile' : self.packinfo['file'],
             'levelidx' : self.levelinfo['idx'],
             'curtime'  : self.curtime,
-            'undo'     : self.undo + [(self.currentgrid.copy(), self.pushes)],
+            'moves'    : self.moves(),
+            'redo'     : "".join(self.redo),
         }
         # pickle to file...
         fo = gzip.open(self.SAVEFILE, "wb")
@@ -362,16 +845,21 @@ class Sokoban:
                 played += int(pt[0]) + int(pt[1]) / 1000.0
                 self.starttime = time.time() - played
                 self.updatetime()
-            if obj['undo']:
-                self.undo = obj['undo']
-                uds = self.undo.pop()
-                self.currentgrid = Grid(uds[0])
-                self.pushes = uds[1]
+            if 'undo' in obj:
+                # old savegame with one grid per move
+                obj['moves'] = converda.stack2steps(obj['undo'])[1] if obj['undo'] else ""
+                obj['redo'] = ""
+            for d in obj['moves']:
+                pushed = self.currentgrid.move(d)
+                if pushed is None: break
+                self.undo.append((d, pushed))
+                self.pushes += pushed
+            self.redo = list(obj['redo'])
     
     def getsolution(self, idx=None):
         """
         get solution for current level or idx level in current pack
-        [(gridarray, pushes), (griddarray, pushes), ...]
+        as Replay: [(FlatGrid, pushes), (FlatGrid, pushes), ...]
         """
         assert self.levelinfo is not None or idx is not None, "No current or selected level"
         idx = str(idx if idx is not None else self.levelinfo['idx'])
@@ -381,34 +869,38 @@ class Sokoban:
             and self.revidx[1] == idx):
             return self.revstack
 
-        if self.packinfo['file'] not in self.solutions: return None
-        csp = self.solutions[self.packinfo['file']]
-        if idx not in csp: return None
-        self.revstack = converda.steps2stack(csp[idx])
+        cs = self.solutions.get(self.packinfo['file'], idx)
+        if cs is None: return None
+        self.revstack = Replay(cs)
         self.revidx = (self.packinfo['file'], idx)
         return self.revstack
     
+    def getsummary(self, idx=None):
+        """
+        (moves, pushes) of the solution for current level or idx level in current pack
+        or None. Doesn't replay anything, so it's cheap enough for level lists.
+        """
+        assert self.levelinfo is not None or idx is not None, "No current or selected level"
+        idx = idx if idx is not None else self.levelinfo['idx']
+        cs = self.solutions.summary(self.packinfo['file'], idx)
+        if cs is None: return None
+        return cs['moves'], cs['pushes']
+    
     def setsolution(self):
         assert self.levelinfo is not None, "No current level"
-        # copy undo-stack and add current position
-        steps = [(x[0], x[1]) for x in self.undo]
-        steps += [(self.currentgrid.copy(), self.pushes)]
+        start = self.levellist()[self.levelinfo['idx']][1]
+        moves = self.solutionmoves()
         # is there already a better solution (less moves)?
-        csm = self.getsolution()
-        if csm is not None and len(steps) >= len(csm):
+        csm = self.getsummary()
+        if csm is not None and len(moves) >= csm[0]:
             return False
-        if self.packinfo['file'] not in self.solutions:
-            self.solutions[self.packinfo['file']] = {}
-        self.solutions[self.packinfo['file']][str(self.levelinfo['idx'])] = converda.stack2steps(steps)
-        # save to file
-        fo = gzip.open(self.SOLFILE, 'w')
-        fo.write(converda.prettyjson(self.solutions).encode("ascii"))
-        fo.close()
+        # startframe and moves
+        self.solutions.put(self.packinfo['file'], self.levelinfo['idx'], (start.rows(), moves))
+        self.revstack = None
         return True
 
 
 if __name__ == '__main__':
-    import random
     g = Sokoban("levels.zip")
     #g = sokoban.Sokoban("testlevels.zip")
     sys.stdout.write("Found %d levels in %d packs\n" % (g.cumlevels, len(g.packs)))
@@ -420,4 +912,5 @@ if __name__ == '__main__':
     sys.stdout.write("Loaded random level: %d [%s]\n" % (g.levelinfo['idx'], g.levelinfo['name']))
     sys.stdout.write(str(g.currentgrid))
     sys.stdout.write("\n")
+    sys.stdout.write("Pack cache: %(entries)d packs, ~%(size)d bytes, %(hits)d hits, %(misses)d misses, %(evictions)d evictions\n" % g.packcache.stats())
 
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# solstore: Lösungen werden nicht mehr bei jedem Speichern komplett neu
+# geschrieben, sondern pro Pack an ein Journal angehängt. Geladen wird ein
+# Pack erst, wenn es gebraucht wird. Überholte Einträge räumt ab und zu ein
+# Hintergrund-Thread weg.
+#
+# One file per pack in the store directory, one JSON record per line:
+#   ["levelindex", startframe, moves, {"moves": int, "pushes": int, "hash": str}]
+# The last record of a level wins. The summary (4th element) is there so level
+# lists don't have to replay any solution.
+
+import os, sys, json, gzip, hashlib, threading, sokoban
+
+BROKEN = (ValueError, TypeError, KeyError, IndexError, AssertionError) # what a broken record raises
+
+def replace(src, dst):
+    """rename src to dst, overwriting dst (python 2 on windows can't do that)"""
+    if hasattr(os, "replace"): return os.replace(src, dst)
+    if os.path.exists(dst): os.remove(dst)
+    os.rename(src, dst)
+
+def summarize(solution):
+    """summary of a solution (startframe, moves): {'moves': int, 'pushes': int, 'hash': str}"""
+    grid = sokoban.FlatGrid(solution[0])
+    pushes = 0
+    for d in solution[1]: pushes += grid.move(d)
+    digest = hashlib.md5(json.dumps([solution[0], solution[1]]).encode("ascii")).hexdigest()
+    return {'moves': len(solution[1]), 'pushes': pushes, 'hash': digest}
+
+class SolutionStore(object):
+    """
+    Solutions of all packs: {packfile: {levelindex: (startframe, moves, summary), }, }
+    Only packs asked for are read from disk.
+    A 'readonly' store never writes to the directory (no import, no compaction).
+    """
+    COMPACT = 16 # compact a journal if it has this many outdated records
+
+    def __init__(self, directory, legacy=None, readonly=False):
+        self.directory = directory
+        self.readonly = readonly
+        self.packs = {} # loaded packs {packfile: {levelindex: (startframe, moves, summary)}}
+        self.outdated = {} # number of superseded records in each journal {packfile: int}
+        self.lock = threading.Lock()
+        if not readonly and not os.path.isdir(directory):
+            self.importfile(legacy)
+
+    def importfile(self, legacy):
+        """create store, import solutions from an old .hgz-file (if any)"""
+        solutions = {}
+        if legacy and os.path.exists(legacy):
+            try:
+                fo = gzip.open(legacy, 'r')
+                solutions = json.load(fo)
+                fo.close()
+            except Exception as e:
+                sys.stderr.write("Cannot import solutions from %s: %s\n" % (legacy, e))
+        # write to temporary directory first, so an interrupted import is repeated
+        tmp = self.directory + ".tmp"
+        if not os.path.isdir(tmp): os.makedirs(tmp)
+        for packfile, levels in solutions.items():
+            good = {}
+            for idx, sol in (levels.items() if isinstance(levels, dict) else ()):
+                try:
+                    int(idx) # see writepack()
+                    good[idx] = (sol[0], sol[1], summarize(sol))
+                except BROKEN as e:
+                    sys.stderr.write("Cannot import solution %s %s: %r\n" % (packfile, idx, e))
+            self.writepack(os.path.join(tmp, self.filename(packfile)), good)
+        os.rename(tmp, self.directory)
+
+    def filename(self, packfile):
+        return packfile.replace("%", "%25").replace("/", "%2F") + ".jnl"
+
+    def path(self, packfile):
+        return os.path.join(self.directory, self.filename(packfile))
+
+    def packfiles(self):
+        """packfiles of all journals in the store (solved or not)"""
+        return sorted(fn[:-4].replace("%2F", "/").replace("%25", "%")
+                      for fn in os.listdir(self.directory) if fn.endswith(".jnl"))
+
+    def writepack(self, path, levels):
+        fo = open(path + ".tmp", "w")
+        for idx in sorted(levels, key=int):
+            fo.write(json.dumps([idx] + list(levels[idx])) + "\n")
+        fo.close()
+        replace(path + ".tmp", path)
+
+    def pack(self, packfile):
+        """all solutions of a pack {levelindex: (startframe, moves, summary)}"""
+        if packfile in self.packs: return self.packs[packfile]
+        levels = {}
+        records = 0
+        nosummary = False
+        if os.path.exists(self.path(packfile)): # otherwise nothing solved yet
+            fo = open(self.path(packfile), "r")
+            for line in fo:
+                try:
+                    rec = json.loads(line)
+                    if len(rec) < 4: # written without summary
+                        rec.append(summarize(rec[1:3]))
+                        nosummary = True
+                except BROKEN:
+                    continue # broken record (e.g. crash while writing)
+                levels[rec[0]] = tuple(rec[1:4])
+                records += 1
+            fo.close()
+        self.packs[packfile] = levels
+        self.outdated[packfile] = records - len(levels)
+        if nosummary and not self.readonly: self.background(packfile)
+        return levels
+
+    def get(self, packfile, idx):
+        """solution (startframe, moves) for level idx of a pack or None"""
+        sol = self.pack(packfile).get(str(idx))
+        return sol[:2] if sol else None
+
+    def summary(self, packfile, idx):
+        """{'moves': int, 'pushes': int, 'hash': str} of the solution for level idx or None"""
+        sol = self.pack(packfile).get(str(idx))
+        return sol[2] if sol else None
+
+    def put(self, packfile, idx, solution):
+        """add or replace solution (startframe, moves) for level idx of a pack"""
+        assert not self.readonly, "Solution store is read-only"
+        idx = str(idx)
+        levels = self.pack(packfile)
+        rec = (solution[0], solution[1], summarize(solution))
+        with self.lock:
+            if idx in levels: self.outdated[packfile] += 1
+            levels[idx] = rec
+            fo = open(self.path(packfile), "ab+")
+            # a torn last record (crash while writing) gets its line end, so it doesn't take this one with it
+            fo.seek(0, os.SEEK_END)
+            if fo.tell():
+                fo.seek(-1, os.SEEK_END)
+                if fo.read(1) != b"\n": fo.write(b"\n")
+            fo.write((json.dumps([idx] + list(rec)) + "\n").encode("ascii"))
+            fo.close()
+        if self.outdated[packfile] >= self.COMPACT: self.background(packfile)
+
+    def background(self, packfile):
+        """compact journal of a pack in a background thread"""
+        th = threading.Thread(target=self.compact, args=(packfile, True))
+        th.daemon = True
+        th.start()
+
+    def compact(self, packfile, force=False):
+        """rewrite journal of a pack with only the current solutions"""
+        with self.lock:
+            if not force and not self.outdated.get(packfile): return
+            self.writepack(self.path(packfile), self.packs[packfile])
+            self.outdated[packfile] = 0
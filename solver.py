@@ -0,0 +1,647 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# solver: löst Levels selbst. Gesucht wird auf Ebene der Schübe (der Spieler
+# läuft ja beliebig, solange er nichts verschiebt), per A* oder IDA*.
+# Heraus kommt ein ganz normaler Zug-String, wie ihn auch der Spieler
+# erzeugt, also (startframe, moves) wie in converda / solstore.
+#
+# A state is a FlatGrid. Two states are the same if the crates are on the same
+# cells and the player can reach the same area, so the player is normalized to
+# the top-left-most cell he can reach. States are identified by their Zobrist
+# hash (FlatGrid.key()) in the transposition table. Cost is the number of
+# pushes, the lower bound is the least sum of push distances over all
+# assignments of crates to targets (ignoring the other crates, see Matching).
+# Pushes into dead squares or deadlocks (FlatGrid.isdead) are never generated.
+# Open states are kept as bytes (see Solver.encode()), the closed ones in a
+# ClosedSet, which goes to disk when it gets too big.
+# Progress can be watched with a hook (see Solver.stats()), e.g. jsonlines().
+# The anytime mode (weighted A*) has a solution early and improves it as long
+# as it may run. It can save its open and closed states to a checkpoint file
+# (gzipped JSON lines) and carry on from there next time.
+
+import os, sys, json, gzip, time, heapq, binascii, struct, argparse, array, sokoban, closedset, solstore
+try:
+    import numpy
+except ImportError:
+    numpy = None
+try:
+    import resource
+except ImportError: # windows
+    resource = None
+
+TABLES = {} # {FlatGrid.statichash(): DistanceTable, }
+INF = 1 << 30 # cost of an assignment that's not possible
+
+def pulls(grid, sources):
+    """
+    Push distance from every cell of a FlatGrid to the nearest of the cells
+    'sources', if there were no other crates (pull crates away from there).
+    returns a list with None for cells no crate can get there from
+    """
+    w, h = grid.width, grid.height
+    free = [not c & grid.WALL for c in grid.cells]
+    dist = [None] * len(free)
+    todo = list(sources)
+    for i in todo: dist[i] = 0
+    for i in todo: # todo grows while walking it: breadth first
+        row, col = divmod(i, w)
+        for dr, dc in grid.OFFSET.values():
+            # see deadsquares()
+            if not (0 <= row + 2*dr < h and 0 <= col + 2*dc < w): continue
+            j = i + dr * w + dc
+            if dist[j] is None and free[j] and free[j + dr * w + dc]:
+                dist[j] = dist[i] + 1
+                todo.append(j)
+    return dist
+
+def distancetable(grid):
+    """DistanceTable of a FlatGrid, cached per level"""
+    key = grid.statichash()
+    if key not in TABLES: TABLES[key] = DistanceTable(grid)
+    return TABLES[key]
+
+
+class DistanceTable(object):
+    """
+    Push distance from every cell to every single target (see pulls()), one
+    unsigned short each, in a numpy array if there is numpy.
+    """
+    NONE = 0xffff # no way to this target
+
+    def __init__(self, grid):
+        self.targets = [i for i, c in enumerate(grid.cells) if c & grid.TARGET]
+        nt = len(self.targets)
+        if numpy is not None:
+            self.data = numpy.full((len(grid.cells), nt), self.NONE, dtype=numpy.uint16)
+        else:
+            self.data = array.array('H', [self.NONE]) * (len(grid.cells) * nt)
+        for t, target in enumerate(self.targets):
+            for i, d in enumerate(pulls(grid, [target])):
+                if d is None: continue
+                if numpy is not None: self.data[i, t] = min(d, self.NONE - 1)
+                else: self.data[i * nt + t] = min(d, self.NONE - 1)
+
+    def row(self, cell):
+        """distances from cell to all targets [int, ...] (INF: no way there)"""
+        nt = len(self.targets)
+        row = self.data[cell].tolist() if numpy is not None else self.data[cell * nt:(cell + 1) * nt].tolist()
+        return [INF if d == self.NONE else d for d in row]
+
+
+class Matching(object):
+    """
+    Assignment of crates to targets with the least sum of push distances
+    (hungarian method). That sum is a lower bound of the pushes left, or None
+    if there is no assignment at all (i.e. a deadlock).
+    moved() takes over the assignment and potentials and only needs one
+    augmenting path (O(n^2)) for the crate that moved instead of O(n^3).
+    """
+    __slots__ = ('table', 'crates', 'rows', 'match', 'u', 'v', 'bound')
+
+    def __init__(self, table, crates=None):
+        self.table = table
+        if crates is None: return # filled by moved()
+        n = len(crates)
+        # 1-based (row/column 0 is the start of every augmenting path)
+        self.crates = [None] + list(crates)
+        self.rows = [None] + [table.row(c) for c in crates] # cost of crate i to target j-1
+        self.match = [0] * (n + 1) # row (crate) assigned to column (target) j
+        self.u = [0] * (n + 1) # potentials of rows
+        self.v = [0] * (n + 1) # potentials of columns
+        for i in range(1, n + 1): self.augment(i)
+        self.total()
+
+    def augment(self, i0):
+        """assign the free row i0 along the cheapest augmenting path"""
+        rows, match, u, v = self.rows, self.match, self.u, self.v
+        m = len(match)
+        minv = [float("inf")] * m
+        used = [False] * m
+        way = [0] * m
+        match[0] = i0
+        j0 = 0
+        while True:
+            used[j0] = True
+            i0 = match[j0]
+            row = rows[i0]
+            delta = float("inf")
+            j1 = 0
+            for j in range(1, m):
+                if used[j]: continue
+                cur = row[j-1] - u[i0] - v[j]
+                if cur < minv[j]:
+                    minv[j] = cur
+                    way[j] = j0
+                if minv[j] < delta:
+                    delta = minv[j]
+                    j1 = j
+            for j in range(m):
+                if used[j]:
+                    u[match[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if match[j0] == 0: break
+        while j0: # flip the path
+            j1 = way[j0]
+            match[j0] = match[j1]
+            j0 = j1
+
+    def total(self):
+        cost = 0
+        for j in range(1, len(self.match)):
+            c = self.rows[self.match[j]][j-1]
+            if c >= INF:
+                cost = None
+                break
+            cost += c
+        self.bound = cost
+
+    def moved(self, src, dst):
+        """new Matching after the crate on cell src was pushed to dst"""
+        new = Matching(self.table)
+        i = self.crates.index(src)
+        new.crates = self.crates[:]
+        new.crates[i] = dst
+        new.rows = self.rows[:]
+        new.rows[i] = row = self.table.row(dst)
+        new.match = self.match[:]
+        new.match[new.match.index(i, 1)] = 0 # crate i is free now
+        new.u = self.u[:]
+        new.v = v = self.v[:]
+        # keep potentials feasible for the new costs of crate i
+        new.u[i] = min(row[j-1] - v[j] for j in range(1, len(v)))
+        new.augment(i)
+        new.total()
+        return new
+
+def peakrss():
+    """peak resident set size of this process in bytes (None if unknown)"""
+    if resource is None: return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+def jsonlines(fo, **extra):
+    """hook for Solver: write each record as a JSON line to fo (with 'extra' keys added)"""
+    def hook(record):
+        record.update(extra)
+        fo.write(json.dumps(record, sort_keys=True) + "\n")
+        fo.flush()
+    return hook
+
+def walk(grid, dst):
+    """shortest moves (string) for the player to walk to cell dst without pushing, or None"""
+    w, h = grid.width, grid.height
+    cells = grid.cells
+    came = {grid.player: None} # {cell: (previous cell, direction)}
+    todo = [grid.player]
+    for i in todo:
+        if i == dst:
+            path = []
+            while came[i] is not None:
+                i, d = came[i]
+                path.append(d)
+            return "".join(reversed(path))
+        row, col = divmod(i, w)
+        for d, (dr, dc) in grid.OFFSET.items():
+            if not (0 <= row + dr < h and 0 <= col + dc < w): continue
+            j = i + dr * w + dc
+            if j not in came and not cells[j] & (grid.WALL | grid.CRATE):
+                came[j] = (i, d)
+                todo.append(j)
+    return None
+
+
+class Solver(object):
+    """
+    Find a solution with the least number of pushes for one level.
+    'maxnodes' limits the number of expanded states, 'maxtime' the seconds
+    solve() may take (None: no limit). The closed set is kept in memory up
+    to about 'memory' bytes, the rest is spilled to disk (None: no limit).
+    After solve(): 'status' is one of 'solved', 'unsolvable' or 'limit',
+    'nodes' is the number of expanded states, 'generated' of generated ones
+    and 'tthits' how often the transposition table pruned a state, see
+    stats() for all counters.
+    'hook' is called with stats() about every 'interval' seconds while
+    solving and once at the end.
+    For the anytime method: 'weight' is the weight of the lower bound, the
+    search state is saved to 'checkpoint' (if given) every 'every' seconds
+    and when the budget is used up, and read from there on the next solve().
+    Counters go on from the checkpoint, 'maxnodes' and 'maxtime' are per run.
+    """
+    PRUNES = ("deadsquare", "corner", "block", "matching")
+    MATCHINGS = 20000 # Matchings of generated states kept for their expansion
+
+    def __init__(self, grid, maxnodes=None, maxtime=None, memory=None, hook=None, interval=1.0,
+                 weight=2.0, checkpoint=None, every=60):
+        if not isinstance(grid, sokoban.FlatGrid): grid = sokoban.FlatGrid(grid)
+        self.start = grid.copy()
+        self.start.isdead() # count deadlocks once (and get the deadmap), copies keep them up to date
+        self.table = None # DistanceTable, built by solve() (on the clock)
+        assert len(grid.cells) <= 0xffff, "Level too big (%d cells)" % len(grid.cells)
+        self.static = bytes(self.start.cells).translate(grid.STATIC) # walls and targets
+        self.maxnodes = maxnodes
+        self.maxtime = maxtime
+        self.deadline = None
+        self.memory = memory
+        self.closed = None # current ClosedSet
+        self.hook = hook
+        self.interval = interval
+        self.weight = weight
+        self.checkpoint = checkpoint
+        self.every = every
+        self.status = None
+        self.reset()
+
+    def reset(self):
+        self.nodes = self.generated = self.tthits = self.ttlookups = self.ttsize = 0
+        self.prunes = dict((p, 0) for p in self.PRUNES) # pushes not generated, by reason
+        self.bound = None # lowest f of all open states (IDA*: threshold)
+        self.best = None # pushes of the best solution so far (anytime)
+        self.started = self.lastreport = self.lastsave = time.time()
+        self.matchings = sokoban.LRU(self.MATCHINGS) # {key: Matching}, see matching()
+        self.lastnodes = self.firstnode = 0 # firstnode: nodes before this run (checkpoint)
+
+    def stats(self):
+        """
+        counters as dict: nodes (expanded), generated, nps (nodes per second
+        since the last call), tt (states in the closed set), tthits, hitrate,
+        prunes {deadsquare, corner, block, matching: int}, rss (peak, bytes),
+        bound, best (pushes of the best solution so far, anytime only), time
+        (seconds) and status (None while solving)
+        """
+        now = time.time()
+        nps = (self.nodes - self.lastnodes) / max(now - self.lastreport, 1e-6)
+        self.lastreport, self.lastnodes = now, self.nodes
+        return {
+            'nodes': self.nodes, 'generated': self.generated, 'nps': round(nps, 1),
+            'tt': self.ttsize, 'tthits': self.tthits,
+            'hitrate': round(self.tthits / float(self.ttlookups), 4) if self.ttlookups else 0.0,
+            'prunes': dict(self.prunes), 'rss': peakrss(), 'bound': self.bound,
+            'best': len(self.best) if self.best is not None else None,
+            'time': round(now - self.started, 3), 'status': self.status,
+        }
+
+    def deadtype(self, grid, cell):
+        """which pattern of FlatGrid.isdead() a crate pushed to 'cell' caused: 'block' or 'corner'"""
+        w = grid.width
+        for q in grid.windows(cell):
+            if grid.quaddead(q):
+                quad = (grid.cells[q], grid.cells[q+1], grid.cells[q+w], grid.cells[q+w+1])
+                if all(1 < v < 8 for v in quad): return "block"
+        return "corner"
+
+    def crates(self, grid):
+        return [i for i, c in enumerate(grid.cells) if c & grid.CRATE]
+
+    def encode(self, grid):
+        """state of a grid as bytes: sorted crate cells and normalized player cell (2 bytes each)"""
+        grid.key() # make sure region is known
+        cells = self.crates(grid) + [grid.region]
+        return struct.pack("<%dH" % len(cells), *cells)
+
+    def decode(self, state):
+        """FlatGrid from encode()"""
+        cells = struct.unpack("<%dH" % (len(state) // 2), state)
+        grid = self.start.copy()
+        grid.cells = bytearray(self.static)
+        grid.todo = 0
+        grid.zobrist = 0
+        for c in cells[:-1]:
+            grid.cells[c] |= grid.CRATE
+            grid.todo += not grid.cells[c] & grid.TARGET
+            grid.zobrist ^= grid.keys[0][c]
+        grid.cells[cells[-1]] |= grid.SOKO
+        grid.player = grid.region = cells[-1]
+        grid.dead = 0 # it wasn't when it was generated
+        return grid
+
+    def matching(self, grid, key=None):
+        """
+        Matching of a grid, its 'bound' is the lower bound of pushes left.
+        The one from when the state 'key' was generated if it's still there,
+        a new one (O(n^3)) otherwise.
+        """
+        match = self.matchings.get(key) if key is not None else None
+        return match if match is not None else Matching(self.table, self.crates(grid))
+
+    def children(self, grid, match):
+        """
+        yield (FlatGrid, key, push, Matching) for every possible push from
+        'grid' (with Matching 'match'), push is (cell the player pushes from,
+        direction)
+        """
+        w, h = grid.width, grid.height
+        seen = grid.reachable()[0]
+        cells = grid.cells
+        for c in self.crates(grid):
+            row, col = divmod(c, w)
+            for d, (dr, dc) in grid.OFFSET.items():
+                if not (0 <= row - dr < h and 0 <= row + dr < h and 0 <= col - dc < w and 0 <= col + dc < w): continue
+                off = dr * w + dc
+                if not seen[c - off] or cells[c + off] & (grid.WALL | grid.CRATE): continue
+                if grid.deadmap[c + off]:
+                    self.prunes['deadsquare'] += 1
+                    continue
+                child = grid.copy()
+                child.cells[child.player] -= child.SOKO
+                child.cells[c - off] += child.SOKO
+                child.player = c - off # walking: same area, same key
+                child.move(d)
+                self.generated += 1
+                if child.isdead():
+                    self.prunes[self.deadtype(child, c + off)] += 1
+                    continue
+                cmatch = match.moved(c, c + off)
+                if cmatch.bound is None:
+                    self.prunes['matching'] += 1
+                    continue
+                yield child, child.key(), (c - off, d), cmatch
+
+    def exhausted(self):
+        """is the node or time budget used up?"""
+        if self.maxnodes is not None and self.nodes - self.firstnode >= self.maxnodes: return True
+        # on every node: a node of a big level may take longer than the whole budget allows
+        now = time.time()
+        if self.hook is not None and now - self.lastreport >= self.interval: self.hook(self.stats())
+        return self.deadline is not None and now > self.deadline
+
+    def moves(self, pushes):
+        """moves (string) for a list of pushes [(cell to push from, direction), ...]"""
+        grid = self.start.copy()
+        path = []
+        for cell, d in pushes:
+            steps = walk(grid, cell) + d
+            for s in steps: grid.move(s)
+            path.append(steps)
+        return "".join(path)
+
+    def solve(self, method="astar"):
+        """moves (string) of a push-optimal solution or None, see 'status'"""
+        self.reset()
+        self.status = None
+        if self.maxtime is not None: self.deadline = time.time() + self.maxtime
+        try:
+            if self.table is None: self.table = distancetable(self.start)
+            if self.matching(self.start).bound is None or self.start.isdead():
+                self.status = "unsolvable"
+                pushes = None
+            else:
+                pushes = {"astar": self.astar, "idastar": self.idastar, "anytime": self.anytime}[method]()
+        finally:
+            if self.hook is not None: self.hook(self.stats())
+            if self.closed is not None: self.closed.close()
+            self.closed = None
+        return None if pushes is None else self.moves(pushes)
+
+    def newclosed(self):
+        """new (empty) ClosedSet, the last one is dropped"""
+        if self.closed is not None: self.closed.close()
+        self.closed = closedset.ClosedSet(self.memory)
+        self.ttsize = 0 # distinct states in it (len() counts spilled records twice)
+        return self.closed
+
+    def astar(self):
+        """list of pushes or None"""
+        key = self.start.key()
+        tt = self.newclosed() # {key: (pushes so far, parent key, push)}
+        tt.put(key, (0, 0, None))
+        self.ttsize += 1
+        seq = 0 # tie breaker, never compare states
+        heap = [(self.matching(self.start).bound, 0, seq, key, self.encode(self.start))]
+        while heap:
+            f, g, s, key, state = heapq.heappop(heap)
+            g = -g
+            if tt.get(key)[0] < g: continue # reached with less pushes meanwhile
+            self.bound = f
+            grid = self.decode(state)
+            if grid.iswin():
+                self.status = "solved"
+                return self.path(tt, key)
+            if self.exhausted():
+                self.status = "limit"
+                return None
+            self.nodes += 1
+            for child, ckey, push, cmatch in self.children(grid, self.matching(grid, key)):
+                self.ttlookups += 1
+                rec = tt.get(ckey)
+                if rec is not None and rec[0] <= g + 1:
+                    self.tthits += 1
+                    continue
+                self.ttsize += rec is None
+                tt.put(ckey, (g + 1, key, push))
+                seq += 1
+                # deeper first on equal f: gets to the goal faster
+                heapq.heappush(heap, (g + 1 + cmatch.bound, -(g + 1), seq, ckey, self.encode(child)))
+                self.matchings.put(ckey, cmatch)
+        self.status = "unsolvable"
+        return None
+
+    def path(self, tt, key):
+        """pushes from the start to state 'key' along the parents in closed set tt"""
+        pushes = []
+        rec = tt.get(key)
+        while rec[2] is not None:
+            pushes.append(rec[2])
+            rec = tt.get(rec[1])
+        return pushes[::-1]
+
+    def anytime(self):
+        """
+        Weighted A* (g + weight * bound) which goes on after the first solution:
+        states which can't lead to a better one are dropped, all others are
+        searched. Ends as 'solved' if there's nothing left (the best solution
+        is push-optimal then) or 'limit' with the best solution so far.
+        returns list of pushes of the best solution or None
+        """
+        tt, heap, seq = self.load() if self.checkpoint and os.path.exists(self.checkpoint) else (None, None, 0)
+        if tt is None:
+            key = self.start.key()
+            tt = self.newclosed()
+            tt.put(key, (0, 0, None))
+            self.ttsize += 1
+            h = self.matching(self.start).bound
+            heap = [(self.weight * h, 0, seq, key, h, self.encode(self.start))]
+        while heap:
+            entry = heapq.heappop(heap)
+            fw, g, s, key, h, state = entry
+            g = -g
+            if tt.get(key)[0] < g: continue # reached with less pushes meanwhile
+            if self.best is not None and g + h >= len(self.best): continue # can't get better
+            self.bound = g + h
+            grid = self.decode(state)
+            if grid.iswin():
+                self.best = self.path(tt, key)
+                if self.hook is not None: self.hook(self.stats())
+                continue
+            if self.exhausted():
+                heapq.heappush(heap, entry)
+                if self.checkpoint: self.save(tt, heap, seq)
+                self.status = "limit"
+                return self.best
+            if self.checkpoint and time.time() - self.lastsave >= self.every:
+                heapq.heappush(heap, entry)
+                self.save(tt, heap, seq)
+                heapq.heappop(heap)
+            self.nodes += 1
+            for child, ckey, push, cmatch in self.children(grid, self.matching(grid, key)):
+                self.ttlookups += 1
+                rec = tt.get(ckey)
+                if rec is not None and rec[0] <= g + 1:
+                    self.tthits += 1
+                    continue
+                if self.best is not None and g + 1 + cmatch.bound >= len(self.best): continue
+                self.ttsize += rec is None
+                tt.put(ckey, (g + 1, key, push))
+                seq += 1
+                heapq.heappush(heap, (g + 1 + self.weight * cmatch.bound, -(g + 1), seq, ckey, cmatch.bound, self.encode(child)))
+                self.matchings.put(ckey, cmatch)
+        self.status = "solved" if self.best is not None else "unsolvable"
+        if self.checkpoint and os.path.exists(self.checkpoint): os.remove(self.checkpoint) # done
+        return self.best
+
+    def save(self, tt, heap, seq):
+        """
+        write checkpoint: one line of meta data, one line per open state,
+        one line per closed state
+        """
+        meta = {
+            'level': self.start.statichash(), 'start': self.start.key(), 'weight': self.weight,
+            'seq': seq, 'open': len(heap), 'best': self.best, 'nodes': self.nodes,
+            'generated': self.generated, 'tthits': self.tthits, 'ttlookups': self.ttlookups,
+            'prunes': self.prunes, 'time': time.time() - self.started,
+        }
+        fo = gzip.open(self.checkpoint + ".tmp", "wb")
+        fo.write((json.dumps(meta) + "\n").encode("ascii"))
+        for fw, g, s, key, h, state in heap:
+            fo.write((json.dumps([fw, g, s, key, h, binascii.hexlify(state).decode("ascii")]) + "\n").encode("ascii"))
+        for key, (g, parent, push) in tt.items():
+            fo.write((json.dumps([key, g, parent, push]) + "\n").encode("ascii"))
+        fo.close()
+        solstore.replace(self.checkpoint + ".tmp", self.checkpoint)
+        self.lastsave = time.time()
+
+    def load(self):
+        """
+        read checkpoint, returns (ClosedSet, open states, seq) or (None, None, 0)
+        if it's from another level or weight
+        """
+        fo = gzip.open(self.checkpoint, "rb")
+        meta = json.loads(fo.readline().decode("ascii"))
+        if meta['level'] != self.start.statichash() or meta['start'] != self.start.key() or meta['weight'] != self.weight:
+            sys.stderr.write("Checkpoint %s doesn't match, starting over\n" % self.checkpoint)
+            fo.close()
+            return None, None, 0
+        heap = []
+        for i in range(meta['open']):
+            fw, g, s, key, h, state = json.loads(fo.readline().decode("ascii"))
+            heap.append((fw, g, s, key, h, binascii.unhexlify(state)))
+        heapq.heapify(heap)
+        tt = self.newclosed()
+        for line in fo:
+            key, g, parent, push = json.loads(line.decode("ascii"))
+            tt.put(key, (g, parent, tuple(push) if push else None))
+            self.ttsize += 1 # saved from items(): no key twice
+        fo.close()
+        self.best = [tuple(p) for p in meta['best']] if meta['best'] is not None else None
+        self.nodes, self.generated = meta['nodes'], meta['generated']
+        self.tthits, self.ttlookups = meta['tthits'], meta['ttlookups']
+        self.prunes = meta['prunes']
+        self.started -= meta['time']
+        self.lastnodes = self.firstnode = self.nodes
+        return tt, heap, meta['seq']
+
+    def idastar(self):
+        """list of pushes or None"""
+        key = self.start.key()
+        match = self.matching(self.start)
+        threshold = match.bound
+        while True:
+            self.bound = threshold
+            tt = self.newclosed() # {key: (least pushes it was reached with in this iteration, 0, None)}
+            tt.put(key, (0, 0, None))
+            self.ttsize += 1
+            nextthreshold = None
+            path = [] # pushes to the current state
+            # depth first without recursion: stack of children generators
+            stack = [self.children(self.start, match)]
+            self.nodes += 1
+            while stack:
+                for child, ckey, push, cmatch in stack[-1]:
+                    g = len(path) + 1
+                    self.ttlookups += 1
+                    rec = tt.get(ckey)
+                    if rec is not None and rec[0] <= g:
+                        self.tthits += 1
+                        continue
+                    self.ttsize += rec is None
+                    tt.put(ckey, (g, 0, None))
+                    f = g + cmatch.bound
+                    if f > threshold:
+                        if nextthreshold is None or f < nextthreshold: nextthreshold = f
+                        continue
+                    if child.iswin():
+                        self.status = "solved"
+                        return path + [push]
+                    if self.exhausted():
+                        self.status = "limit"
+                        return None
+                    self.nodes += 1
+                    path.append(push)
+                    stack.append(self.children(child, cmatch))
+                    break
+                else: # all children done
+                    stack.pop()
+                    if path: path.pop()
+            if nextthreshold is None:
+                self.status = "unsolvable"
+                return None
+            threshold = nextthreshold
+
+
+def solve(grid, method="astar", maxnodes=None, maxtime=None, memory=None, hook=None):
+    """
+    moves (string) of a push-optimal solution for grid or None, see Solver
+    (method anytime: the best one found within the budget)
+    """
+    return Solver(grid, maxnodes, maxtime, memory, hook).solve(method)
+
+def main():
+    ap = argparse.ArgumentParser(description="Solve a level. Prints the moves.")
+    ap.add_argument("-m", "--method", choices=("astar", "idastar", "anytime"), default="astar")
+    ap.add_argument("-w", "--weight", type=float, default=2.0, help="weight of the lower bound for anytime (default: %(default)s)")
+    ap.add_argument("-c", "--checkpoint", help="anytime: save search to this file and resume from it")
+    ap.add_argument("--every", type=float, default=60, help="seconds between checkpoints (default: %(default)s)")
+    ap.add_argument("-n", "--maxnodes", type=int, help="give up after expanding this many states")
+    ap.add_argument("-t", "--maxtime", type=float, help="give up after this many seconds")
+    ap.add_argument("-M", "--memory", type=int, help="keep closed set in memory up to this many MB, spill the rest to disk")
+    ap.add_argument("-s", "--save", action="store_true", help="store solution (if it's better than the known one)")
+    ap.add_argument("--stats", help="write progress as JSON lines to this file ('-': stderr)")
+    ap.add_argument("--interval", type=float, default=1.0, help="seconds between progress records (default: %(default)s)")
+    ap.add_argument("levelzip", help="e.g. levels.zip")
+    ap.add_argument("pack", help="packfile or its index")
+    ap.add_argument("level", type=int, help="index of level in pack")
+    args = ap.parse_args()
+    soko = sokoban.Sokoban(args.levelzip)
+    packfiles = [p['file'] for p in soko.packs]
+    soko.loadpack(packfiles.index(args.pack) if args.pack in packfiles else int(args.pack))
+    soko.loadlevel(args.level)
+    stats = None
+    if args.stats: stats = sys.stderr if args.stats == "-" else open(args.stats, "a")
+    hook = jsonlines(stats, pack=soko.packinfo['file'], level=args.level) if stats else None
+    solver = Solver(soko.currentgrid, args.maxnodes, args.maxtime, args.memory and args.memory << 20, hook, args.interval,
+                    args.weight, args.checkpoint, args.every)
+    moves = solver.solve(args.method)
+    if stats and stats is not sys.stderr: stats.close()
+    sys.stderr.write("%s: %d nodes expanded, %d generated, %d transposition hits\n" % (
+        solver.status, solver.nodes, solver.generated, solver.tthits))
+    if moves is None: sys.exit(1)
+    sys.stdout.write(moves + "\n")
+    if args.save:
+        for d in moves: soko.play(d)
+        if soko.setsolution(): sys.stderr.write("Solution saved.\n")
+
+if __name__ == '__main__':
+    main()